@@ -0,0 +1,566 @@
+import json
+import multiprocessing
+import random
+import re
+import threading
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from psycopg2.extensions import adapt
+
+# Everything generated here is a pure function of (seed, name), so two runs
+# with the same parameters see byte-identical responses.
+
+BENCH_START_DAY = "2026-01-01"
+POD_SUFFIX_CHARS = "bcdfghjklmnpqrstvwxz2456789"
+
+
+def _rng(seed, name):
+    return random.Random(zlib.crc32(f"{seed}:{name}".encode("utf-8")))
+
+
+def bench_days(days):
+    start = datetime.strptime(BENCH_START_DAY, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def provider_ids(providers):
+    return [f"bench-provider-{i:05d}" for i in range(providers)]
+
+
+def provider_job(provider_id):
+    return f"k8s/{provider_id}/dcgm-exporter"
+
+
+def deployment_names(deployments):
+    return [f"model-test-bench-{i:05d}" for i in range(deployments)]
+
+
+def pod_template_hash(seed, deployment):
+    rng = _rng(seed, f"hash:{deployment}")
+    return "".join(rng.choice(POD_SUFFIX_CHARS) for _ in range(9))
+
+
+def pod_name(seed, deployment, index):
+    rng = _rng(seed, f"pod:{deployment}:{index}")
+    suffix = "".join(rng.choice(POD_SUFFIX_CHARS) for _ in range(5))
+    return f"{deployment}-{pod_template_hash(seed, deployment)}-{suffix}"
+
+
+# --- StarRocks / MySQL ------------------------------------------------------
+
+def matched_record_rows(seed, providers, days):
+    """Rows of the ProviderTokenCost / request-log join; about 2% never match"""
+    rows = []
+    for day in bench_days(days):
+        for provider_id in provider_ids(providers):
+            rng = _rng(seed, f"tokens:{provider_id}:{day}")
+            unmatched = rng.random() < 0.02
+            rows.append({
+                "id": provider_id,
+                "input_tokens": None if unmatched else rng.randint(10**6, 10**9),
+                "output_tokens": None if unmatched else rng.randint(10**5, 10**8),
+                "model": f"model-{provider_id}",
+                "url": f"http://{provider_id}.bench/v1",
+                "event_date": day,
+            })
+    return rows
+
+
+_ID_FILTER = re.compile(r"ptc\.id (NOT )?IN \(([^)]*)\)")
+
+
+class FakeMySQLCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = []
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, query, params=None):
+        self.connection.calls["execute"] += 1
+        self._rows = self.connection.rows
+        # Honour the provider filters of the matched-records query
+        for negated, id_list in _ID_FILTER.findall(query):
+            ids = set(re.findall(r"'((?:[^']|'')*)'", id_list))
+            self._rows = [row for row in self._rows if (row["id"] in ids) != bool(negated)]
+        self._position = 0
+
+    def fetchmany(self, size):
+        self.connection.calls["fetchmany"] += 1
+        batch = self._rows[self._position:self._position + size]
+        self._position += len(batch)
+        return batch
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class FakeMySQLConnection:
+    """Serves a fixed row set to every query, counting cursor calls"""
+
+    def __init__(self, rows, calls):
+        self.rows = rows
+        self.calls = calls
+
+    def cursor(self, dictionary=False, buffered=None):
+        return FakeMySQLCursor(self)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# --- Postgres ---------------------------------------------------------------
+
+def gpu_hour_cost_rows(seed, providers):
+    rows = []
+    for provider_id in provider_ids(providers):
+        rng = _rng(seed, f"gpu:{provider_id}")
+        rows.append({
+            "model": f"model-{provider_id}",
+            "cluster": provider_id,
+            "card_num": rng.choice([1, 2, 4, 8]),
+            "price": round(rng.uniform(0.8, 4.0), 3),
+        })
+    return rows
+
+
+class FakePgCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def mogrify(self, template, args):
+        return template % tuple(adapt(arg).getquoted() for arg in args)
+
+    def execute(self, query, params=None):
+        self.connection.calls["execute"] += 1
+        text = query.decode("utf-8") if isinstance(query, bytes) else query
+        if '"GPUHourCost"' in text and text.lstrip().upper().startswith("SELECT"):
+            self._rows = self.connection.gpu_rows
+        else:
+            self._rows = []
+            self.rowcount = text.count("),(") + 1 if "VALUES" in text else 0
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+
+class FakePgConnection:
+    """Answers GPUHourCost selects and accepts any write, counting calls"""
+
+    encoding = "UTF8"
+
+    def __init__(self, gpu_rows, calls):
+        self.gpu_rows = gpu_rows
+        self.calls = calls
+        self.autocommit = True
+        self.status = 1
+
+    def cursor(self, cursor_factory=None):
+        return FakePgCursor(self)
+
+    def commit(self):
+        self.calls["commit"] += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# --- Prometheus and Kubernetes API over HTTP -----------------------------------
+
+def _unescape_promql_regex(value):
+    """Undo _promql_regex_literal for the plain job names generated here"""
+    return re.sub(r"\\(.)", r"\1", value.replace("\\\\", "\\"))
+
+
+def _grid(params):
+    start = float(params["start"]) if _is_number(params["start"]) else _parse_time(params["start"])
+    end = float(params["end"]) if _is_number(params["end"]) else _parse_time(params["end"])
+    step = _parse_step(params["step"])
+    count = int((end - start) // step) + 1
+    return [start + i * step for i in range(count)], step
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _parse_step(step):
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if _is_number(step):
+        return float(step)
+    return float(step[:-1]) * units[step[-1]]
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def sweep_metric(query, args):
+    """Value the fake reports for one sweep query, given the pod's vLLM args"""
+    max_num_seqs = int(args[args.index("--max-num-seqs") + 1]) if "--max-num-seqs" in args else 1
+    window = int(re.search(r"\[(\d+)s\]", query).group(1))
+    if "histogram_quantile" in query:
+        return 0.5 + max_num_seqs / 100
+    if "prompt_tokens" in query:
+        return max_num_seqs * 200 * window
+    if "generation_tokens" in query:
+        return max_num_seqs * 20 * window
+    return max_num_seqs * window
+
+
+class FakeClusterState:
+    """Prometheus series and Kubernetes objects served by FakeClusterServer"""
+
+    def __init__(self, seed, deployments, pods_per_deployment):
+        self.seed = seed
+        self.deployments = deployment_names(deployments)
+        self.pods_per_deployment = pods_per_deployment
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        now = datetime(2026, 6, 1, tzinfo=timezone.utc)
+        self.deployment_items = []
+        for name in self.deployments:
+            rng = _rng(seed, f"deployment:{name}")
+            age_days = rng.randint(1, 120)
+            ready = 0 if rng.random() < 0.3 else 1
+            self.deployment_items.append({
+                "metadata": {
+                    "name": name,
+                    "namespace": "default",
+                    "labels": {"app": name},
+                    "creationTimestamp": (now - timedelta(days=age_days)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "resourceVersion": str(rng.randint(1, 10**6)),
+                },
+                "spec": {"replicas": ready},
+                "status": {"readyReplicas": ready},
+            })
+        self.pod_items = []
+        for name in self.deployments:
+            template_hash = pod_template_hash(seed, name)
+            for index in range(pods_per_deployment):
+                self.pod_items.append({
+                    "metadata": {
+                        "name": pod_name(seed, name, index),
+                        "namespace": "default",
+                        "labels": {"app": name, "pod-template-hash": template_hash},
+                        "ownerReferences": [{"kind": "ReplicaSet", "name": f"{name}-{template_hash}"}],
+                    },
+                    "status": {"conditions": [
+                        {"type": "Ready", "status": "True", "lastTransitionTime": "2026-05-01T00:00:00Z"},
+                    ]},
+                })
+        self._list_cache = {}
+        # (plural, name) -> object for everything applied through the API;
+        # applying a Deployment also creates its ReplicaSet and one Ready pod
+        self.applied = {}
+
+    def count(self, key):
+        with self.lock:
+            self.calls[key] += 1
+
+    def list_body(self, plural, label_selector=None):
+        with self.lock:
+            applied = [obj for (kind, _), obj in self.applied.items() if kind == plural]
+        if label_selector is None and not applied:
+            if plural not in self._list_cache:
+                items = {"deployments": self.deployment_items, "pods": self.pod_items}.get(plural, [])
+                self._list_cache[plural] = json.dumps(
+                    {"kind": "List", "metadata": {"resourceVersion": "1"}, "items": items}
+                ).encode("utf-8")
+            return self._list_cache[plural]
+        items = {"deployments": self.deployment_items, "pods": self.pod_items}.get(plural, []) + applied
+        if label_selector:
+            wanted = dict(term.split("=", 1) for term in label_selector.split(","))
+            items = [
+                item for item in items
+                if all(item["metadata"].get("labels", {}).get(key) == value for key, value in wanted.items())
+            ]
+        return json.dumps({"kind": "List", "metadata": {"resourceVersion": "1"}, "items": items}).encode("utf-8")
+
+    def get_object(self, plural, name):
+        with self.lock:
+            return self.applied.get((plural, name))
+
+    def apply(self, plural, name, manifest):
+        """
+        Store an applied object; a Deployment is rolled out at once to a Ready pod
+
+        Re-applying an unchanged spec is a no-op, like server-side apply;
+        a changed spec bumps the Deployment's generation.
+        """
+        with self.lock:
+            existing = self.applied.get((plural, name))
+        if existing is not None and existing.get("spec") == manifest.get("spec"):
+            return existing
+        generation = existing["metadata"].get("generation", 0) + 1 if existing is not None else 1
+        created = (datetime(2026, 6, 1, tzinfo=timezone.utc) + timedelta(seconds=len(self.applied)))
+        created_at = created.strftime("%Y-%m-%dT%H:%M:%SZ")
+        ready_at = (created + timedelta(seconds=30)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        manifest.setdefault("metadata", {}).update({"uid": f"uid-{plural}-{name}", "creationTimestamp": created_at})
+        objects = {(plural, name): manifest}
+        if plural == "deployments":
+            template_hash = pod_template_hash(self.seed, name)
+            labels = dict(manifest["spec"]["template"]["metadata"]["labels"], **{"pod-template-hash": template_hash})
+            revision = {"deployment.kubernetes.io/revision": "1"}
+            manifest["metadata"].update({"generation": generation, "annotations": revision})
+            manifest["status"] = {"observedGeneration": generation, "readyReplicas": 1}
+            replicaset = f"{name}-{template_hash}"
+            objects[("replicasets", replicaset)] = {"metadata": {
+                "name": replicaset,
+                "labels": labels,
+                "annotations": revision,
+                "ownerReferences": [{"kind": "Deployment", "name": name, "uid": manifest["metadata"]["uid"]}],
+            }}
+            objects[("pods", pod_name(self.seed, name, 0))] = {
+                "metadata": {
+                    "name": pod_name(self.seed, name, 0),
+                    "labels": labels,
+                    "creationTimestamp": created_at,
+                    "ownerReferences": [{"kind": "ReplicaSet", "name": replicaset}],
+                },
+                "spec": manifest["spec"]["template"]["spec"],
+                "status": {"conditions": [
+                    {"type": "PodScheduled", "status": "True", "lastTransitionTime": created_at},
+                    {"type": "Ready", "status": "True", "lastTransitionTime": ready_at},
+                ]},
+            }
+        with self.lock:
+            self.applied.update(objects)
+        return manifest
+
+    def delete(self, plural, name):
+        """Remove an applied object; deleting a Deployment also removes its ReplicaSet and pods"""
+        with self.lock:
+            obj = self.applied.pop((plural, name), None)
+            if obj is not None and plural == "deployments":
+                for key, child in list(self.applied.items()):
+                    if key[0] in ("replicasets", "pods") and child["metadata"]["labels"].get("app") == name:
+                        del self.applied[key]
+        return obj
+
+    def sweep_result(self, query):
+        """
+        vLLM metrics for applied deployments matched by the query's pod regex
+
+        Throughput grows with --max-num-seqs, so sweep rankings are predictable.
+        """
+        match = re.search(r'pod=~"([^"]*)"', query)
+        prefixes = [pattern[:-2] for pattern in match.group(1).split("|")] if match else []
+        with self.lock:
+            pods = [obj for (kind, _), obj in self.applied.items() if kind == "pods"]
+        result = []
+        for pod in pods:
+            name = pod["metadata"]["name"]
+            if not any(name.startswith(prefix) for prefix in prefixes):
+                continue
+            value = sweep_metric(query, pod["spec"]["containers"][0].get("args", []))
+            result.append({"metric": {"pod": name}, "value": [1767225600, _format(value)]})
+        return {"resultType": "vector", "result": result}
+
+    def instant_result(self, query):
+        """Per-pod request counts for the idle check; about 20% of deployments are idle"""
+        if "vllm:" in query:
+            return self.sweep_result(query)
+        result = []
+        for name in self.deployments:
+            idle = _rng(self.seed, f"idle:{name}").random() < 0.2
+            for index in range(self.pods_per_deployment):
+                value = 0 if idle else _rng(self.seed, f"requests:{name}:{index}").randint(1, 5000)
+                result.append({"metric": {"pod": pod_name(self.seed, name, index)}, "value": [1767225600, _format(value)]})
+        return {"resultType": "vector", "result": result}
+
+    def range_result(self, params):
+        query = params["query"]
+        grid, step = _grid(params)
+        result = []
+        providers = re.findall(r'"provider", "([^"]+)"', query)
+        if providers:
+            kinds = re.findall(r'"kind", "([^"]+)"', query)
+            for provider_id, kind in zip(providers, kinds):
+                values = []
+                for ts in grid:
+                    rng = _rng(self.seed, f"counter:{provider_id}:{kind}:{int(ts)}")
+                    values.append([ts, _format(rng.randint(10**5, 10**9))])
+                result.append({"metric": {"provider": provider_id, "kind": kind}, "values": values})
+            return {"resultType": "matrix", "result": result}
+
+        match = re.search(r'job=~"([^"]*)"', query)
+        jobs = [_unescape_promql_regex(job) for job in match.group(1).split("|")] if match else []
+        for job in jobs:
+            rng = _rng(self.seed, f"gpus:{job}")
+            base = rng.choice([1, 2, 4, 8])
+            values = [[ts, _format(max(0, base - (rng.random() < 0.05)))] for ts in grid]
+            result.append({"metric": {"job": job}, "values": values})
+        return {"resultType": "matrix", "result": result}
+
+
+def _object_path(path):
+    """(plural, name) of a namespaced Kubernetes API path; name is None for lists"""
+    parts = path.strip("/").split("/")
+    if "namespaces" in parts:
+        parts = parts[parts.index("namespaces") + 2:]
+    else:
+        parts = parts[-1:]
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this each response
+    # can stall on a delayed ACK and the fake would dominate the timings
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _prom(self, kind, params):
+        state = self.server.state
+        state.count(f"prometheus {kind}")
+        if kind == "query":
+            data = state.instant_result(params["query"])
+        else:
+            data = state.range_result(params)
+        self._send(200, json.dumps({"status": "success", "data": data}).encode("utf-8"))
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/_bench/calls":
+            with state.lock:
+                body = json.dumps(dict(state.calls)).encode("utf-8")
+                state.calls.clear()
+            return self._send(200, body)
+        if url.path.endswith("/api/v1/query"):
+            return self._prom("query", params)
+        if url.path.endswith("/api/v1/query_range"):
+            return self._prom("query_range", params)
+        if url.path == "/_bench/applied":
+            with state.lock:
+                body = json.dumps(sorted(f"{kind}/{name}" for kind, name in state.applied)).encode("utf-8")
+            return self._send(200, body)
+        plural, name = _object_path(url.path)
+        if name is not None:
+            state.count(f"kube get {plural}")
+            obj = state.get_object(plural, name)
+            if obj is None:
+                return self._send(404, json.dumps({"kind": "Status", "message": "not found"}).encode("utf-8"))
+            return self._send(200, json.dumps(obj).encode("utf-8"))
+        state.count(f"kube list {plural}")
+        self._send(200, state.list_body(plural, params.get("labelSelector")))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(self._read_body().decode("utf-8")).items()}
+        kind = "query_range" if url.path.endswith("/api/v1/query_range") else "query"
+        self._prom(kind, params)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_PATCH(self):
+        body = self._read_body()
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts[-1] == "scale":
+            self.server.state.count("kube scale")
+            return self._send(200, body or b"{}")
+        self.server.state.count(f"kube apply {parts[-2]}")
+        manifest = self.server.state.apply(parts[-2], parts[-1], json.loads(body or b"{}"))
+        self._send(200, json.dumps(manifest).encode("utf-8"))
+
+    def do_DELETE(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        self.server.state.count(f"kube delete {parts[-2]}")
+        self.server.state.delete(parts[-2], parts[-1])
+        self._send(200, b"{}")
+
+
+def _serve(port_queue, seed, deployments, pods_per_deployment):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.state = FakeClusterState(seed, deployments, pods_per_deployment)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class FakeClusterServer:
+    """
+    Prometheus and Kubernetes API fake served from a child process
+
+    Running it out of process keeps response generation out of the
+    benchmarked process's wall time and traced memory. Request counts are
+    read (and reset) with calls().
+    """
+
+    def __init__(self, seed=0, deployments=1000, pods_per_deployment=2):
+        self._args = (seed, deployments, pods_per_deployment)
+        self._process = None
+        self.url = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context("spawn")
+        port_queue = context.Queue()
+        self._process = context.Process(target=_serve, args=(port_queue, *self._args), daemon=True)
+        self._process.start()
+        self.url = f"http://127.0.0.1:{port_queue.get(timeout=60)}"
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
+
+    def calls(self):
+        return requests.get(f"{self.url}/_bench/calls", timeout=10).json()
+
+    def applied(self):
+        """kind/name of every applied object (and the pods and ReplicaSets it created) still present"""
+        return requests.get(f"{self.url}/_bench/applied", timeout=10).json()
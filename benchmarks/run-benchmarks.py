@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "daily"))
+sys.path.append(os.path.join(ROOT, "common"))
+
+import fakes
+from kube_client import KubeClient, _clients
+
+parser = argparse.ArgumentParser(description="Time the gpucost scripts against deterministic local fakes")
+parser.add_argument("--providers", type=int, default=1000, help="providers priced by cal-mil-cost")
+parser.add_argument("--days", type=int, default=90, help="days of hourly GPU samples")
+parser.add_argument("--deployments", type=int, default=2000, help="model-test deployments in the fake cluster")
+parser.add_argument("--pods-per-deployment", type=int, default=2)
+parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark (memory is traced in one extra run)")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--only", action="append", help="run only the named benchmark (repeatable)")
+parser.add_argument("--output-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"))
+parser.add_argument("--compare", help="results file to compare against (default: the latest in --output-dir)")
+
+BENCH_CONTEXT = "bench"
+
+
+def load_script(relative_path, module_name):
+    """Import one of the hyphen-named scripts as a module"""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Benchmark:
+    """A named workload with optional per-run setup; run() returns extra call counts"""
+
+    def __init__(self, name, run, setup=None):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: None)
+
+
+def measure(benchmark, server, repeat):
+    """
+    Time a benchmark repeat times, then trace its peak memory in one more run
+
+    Call counts are taken from the traced run: fake-server requests plus
+    whatever the benchmark reports itself (database cursor calls).
+    """
+    wall = []
+    for _ in range(repeat):
+        benchmark.setup()
+        server.calls()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            benchmark.run()
+            wall.append(time.perf_counter() - started)
+
+    benchmark.setup()
+    server.calls()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            local_calls = benchmark.run() or {}
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    calls = dict(server.calls())
+    calls.update(local_calls)
+    return {
+        "wall_seconds": wall,
+        "median_seconds": statistics.median(wall),
+        "peak_bytes": peak,
+        "calls": dict(sorted(calls.items())),
+    }
+
+
+def cal_mil_cost_benchmarks(args, server):
+    import dbutils
+    import prom_utils
+    import token_sources
+
+    cal = load_script("daily/cal-mil-cost.py", "cal_mil_cost")
+    ids = fakes.provider_ids(args.providers)
+    cal.hourly_gpu_cost_ids2cluster = {id: fakes.provider_job(id) for id in ids}
+    prom_utils.proms_range_url = f"{server.url}/api/v1/query_range"
+
+    mysql_rows = fakes.matched_record_rows(args.seed, args.providers, args.days)
+    gpu_rows = fakes.gpu_hour_cost_rows(args.seed, args.providers)
+    db_calls = Counter()
+    dbutils.mysql_pool = dbutils.ConnectionPool(
+        lambda: fakes.FakeMySQLConnection(mysql_rows, db_calls), lambda conn: True, lambda conn: None
+    )
+    dbutils.pg_pool = dbutils.ConnectionPool(
+        lambda: fakes.FakePgConnection(gpu_rows, db_calls), lambda conn: True, lambda conn: None
+    )
+    days = fakes.bench_days(args.days)
+    cache_dir = tempfile.mkdtemp(prefix="gpucost-bench-")
+
+    def pipeline(token_source):
+        db_calls.clear()
+        with dbutils.pg_pool.connection() as pg_conn:
+            catalog = dbutils.GPUHourCostCatalog(pg_conn)
+            history = cal.price_days(days[0], days[-1], catalog, token_source=token_source)
+            dbutils.bulk_update_providercost_table(pg_conn, cal.latest_cost_updates(history))
+        return {f"db {key}": value for key, value in db_calls.items()}
+
+    def cold_cache():
+        for path in glob.glob(os.path.join(cache_dir, "*")):
+            os.remove(path)
+
+    prom_utils.PROM_CACHE_DIR = cache_dir
+    starrocks = token_sources.StarRocksTokenSource()
+    combined = token_sources.CombinedTokenSource(
+        token_sources.PrometheusTokenSource({id: f'job="{id}"' for id in ids}), starrocks
+    )
+    return [
+        Benchmark("cal-mil-cost (cold Prometheus cache)", lambda: pipeline(starrocks), setup=cold_cache),
+        Benchmark("cal-mil-cost (warm Prometheus cache)", lambda: pipeline(starrocks)),
+        Benchmark("cal-mil-cost (Prometheus token source)", lambda: pipeline(combined)),
+    ]
+
+
+def check_benchmarks(args, server):
+    check = load_script("regular-check/check-model-test-proms.py", "check_model_test_proms")
+    meta = {"context": BENCH_CONTEXT, "vendor": "bench"}
+
+    def reconcile():
+        report = check.reconcile_context(meta, server.url)
+        if report["error"]:
+            raise RuntimeError(report["error"])
+
+    return [Benchmark("check-model-test-proms reconcile", reconcile)]
+
+
+def deploy_benchmarks(args, server):
+    deploy = load_script("model-test-deploy/deploy-template.py", "deploy_template")
+    template = deploy.load_template()
+    entries = [
+        {"id": name[len("model-test-"):], "model": f"bench/model-{i % 50}", "device": f"pool-{i % 8}", "context": BENCH_CONTEXT}
+        for i, name in enumerate(fakes.deployment_names(args.deployments))
+    ]
+
+    def render():
+        for entry in entries:
+            deploy.render_manifests(template, entry["id"], entry["model"], entry["device"])
+
+    def batch():
+        results = deploy.deploy_batch(entries)
+        if any(results.values()):
+            raise RuntimeError(f"batch deploy failed: {results}")
+
+    return [
+        Benchmark("deploy-template render", render),
+        Benchmark("deploy-template batch apply", batch),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(output_dir, explicit=None):
+    if explicit:
+        return explicit
+    files = sorted(glob.glob(os.path.join(output_dir, "*.json")))
+    return files[-1] if files else None
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get("params") != results["params"]:
+        print(f"Note: {baseline_path} was recorded with different parameters")
+    print(f"Compared with {baseline_path} ({baseline.get('git_commit')}):")
+    for name, current in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if before is None:
+            print(f"  {name}: new")
+            continue
+        time_change = current["median_seconds"] / before["median_seconds"] - 1 if before["median_seconds"] else 0.0
+        memory_change = current["peak_bytes"] / before["peak_bytes"] - 1 if before["peak_bytes"] else 0.0
+        print(f"  {name}: time {time_change:+.1%}, peak memory {memory_change:+.1%}")
+
+
+def main():
+    args = parser.parse_args()
+    params = {
+        "providers": args.providers,
+        "days": args.days,
+        "deployments": args.deployments,
+        "pods_per_deployment": args.pods_per_deployment,
+        "seed": args.seed,
+    }
+    baseline_path = previous_results(args.output_dir, args.compare)
+    # The scripts log every mismatch and unmatched row; keep that out of the timings
+    logging.disable(logging.CRITICAL)
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "params": params,
+        "benchmarks": {},
+    }
+
+    with fakes.FakeClusterServer(args.seed, args.deployments, args.pods_per_deployment) as server:
+        _clients[BENCH_CONTEXT] = KubeClient(server.url, token="bench")
+        benchmarks = (
+            cal_mil_cost_benchmarks(args, server)
+            + check_benchmarks(args, server)
+            + deploy_benchmarks(args, server)
+        )
+        for benchmark in benchmarks:
+            if args.only and not any(name in benchmark.name for name in args.only):
+                continue
+            result = measure(benchmark, server, args.repeat)
+            results["benchmarks"][benchmark.name] = result
+            print(
+                f"{benchmark.name}: median {result['median_seconds']:.3f}s, "
+                f"peak {result['peak_bytes'] / 2**20:.1f} MiB, calls {result['calls']}"
+            )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {path}")
+    if baseline_path:
+        print_comparison(results, baseline_path)
+
+
+if __name__ == "__main__":
+    main()
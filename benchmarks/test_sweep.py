@@ -0,0 +1,75 @@
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import unittest
+from collections import Counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "common"))
+
+import fakes
+from kube_client import KubeClient, _clients
+
+SWEEP_CONTEXT = "sweep-test"
+
+
+def load_deploy_template():
+    spec = importlib.util.spec_from_file_location(
+        "deploy_template", os.path.join(ROOT, "model-test-deploy", "deploy-template.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class RunSweepTest(unittest.TestCase):
+    """run_sweep end to end against FakeClusterServer, which rolls deployments out at once"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = fakes.FakeClusterServer(deployments=0).__enter__()
+        _clients[SWEEP_CONTEXT] = KubeClient(cls.server.url, token="test")
+        cls.deploy = load_deploy_template()
+
+    @classmethod
+    def tearDownClass(cls):
+        _clients.pop(SWEEP_CONTEXT, None)
+        cls.server.__exit__(None, None, None)
+
+    def test_ranks_by_cost_and_tears_down(self):
+        spec = {
+            "id": "sweeptest",
+            "model": "bench/model",
+            "device": "pool-0",
+            "context": SWEEP_CONTEXT,
+            "soak_seconds": 1,
+            "gpu_price": 2.0,
+            "grid": {"max_num_seqs": [32, 128, 64]},
+        }
+        self.server.calls()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ranked = self.deploy.run_sweep(spec, self.server.url, timeout=30)
+        calls = self.server.calls()
+
+        # The fake's throughput grows with max_num_seqs, so the cheapest config has the most
+        self.assertEqual([row["serving"]["max_num_seqs"] for row in ranked], [128, 64, 32])
+        self.assertEqual(
+            [row["deployment"] for row in ranked],
+            ["model-test-sweeptest-1", "model-test-sweeptest-2", "model-test-sweeptest-0"],
+        )
+        costs = [row["outputCostMil"] for row in ranked]
+        self.assertNotIn(None, costs)
+        self.assertEqual(costs, sorted(costs))
+
+        self.assertEqual(self.server.applied(), [])
+        applied = Counter({key.split()[-1]: n for key, n in calls.items() if key.startswith("kube apply ")})
+        deleted = Counter({key.split()[-1]: n for key, n in calls.items() if key.startswith("kube delete ")})
+        self.assertEqual(applied["deployments"], 3)
+        self.assertEqual(deleted, applied)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import requests
+
+PREFIX = "gpucost_"
+# node_exporter sets its own job label, so textfile samples name their job here
+TEXTFILE_JOB_LABEL = "gpucost_job"
+
+# name -> (type, help) for every metric the jobs record
+METRICS = {
+    "stage_duration_seconds": ("summary", "Time spent in a job stage"),
+    "stage_errors": ("counter", "Job stages that ended with an exception"),
+    "rows_fetched": ("counter", "Rows read from a database"),
+    "queries": ("counter", "Queries issued to a backend"),
+    "retries": ("counter", "Operations retried after a failure"),
+    "bytes_downloaded": ("counter", "Response bytes read from a backend"),
+    "records": ("counter", "Records processed, by provider or context"),
+    "job_duration_seconds": ("gauge", "Wall time of the last job run"),
+    "job_success": ("gauge", "Whether the last job run succeeded (1) or failed (0)"),
+    "job_last_success_timestamp_seconds": ("gauge", "Unix time of the last successful job run"),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class JobMetrics:
+    """
+    Thread-safe registry of spans, counters and gauges for one job run
+
+    The pushed body carries no job label, since the push grouping key sets
+    it; textfile samples carry gpucost_job instead, so several jobs can share
+    one node_exporter textfile directory. Stages add stage and whatever
+    per-provider or per-context labels the caller passes.
+    """
+
+    def __init__(self, job="gpucost"):
+        self.job = job
+        self._lock = threading.Lock()
+        self._values = {}
+        self._started = time.time()
+
+    def _key(self, name, labels):
+        if name not in METRICS:
+            raise ValueError(f"Unknown metric {name}")
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        """Add one observation to a summary (count and sum)"""
+        key = self._key(name, labels)
+        with self._lock:
+            count, total = self._values.get(key, (0, 0.0))
+            self._values[key] = (count + 1, total + value)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a block as one observation of stage_duration_seconds; exceptions are counted and re-raised"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc("stage_errors", stage=stage, **labels)
+            raise
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def finish(self, success):
+        """Record the job-level gauges; call once at the end of a run"""
+        now = time.time()
+        self.set("job_duration_seconds", now - self._started)
+        self.set("job_success", 1 if success else 0)
+        if success:
+            self.set("job_last_success_timestamp_seconds", now)
+
+    def restart(self):
+        """Start timing a new run (daemon mode); counters keep accumulating"""
+        self._started = time.time()
+
+    def render(self, job_label=None):
+        """
+        Render every metric in the Prometheus 0.0.4 text format (what
+        Pushgateway and node_exporter's textfile collector accept), adding
+        the job name under job_label to every sample when one is given
+        """
+        extra = ((job_label, self.job),) if job_label else ()
+        with self._lock:
+            values = dict(self._values)
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            samples = sorted(
+                (tuple(sorted(labels + extra)), value)
+                for (metric, labels), value in values.items()
+                if metric == name
+            )
+            if not samples:
+                continue
+            family = PREFIX + name
+            if kind == "counter":
+                family += "_total"
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for labels, value in samples:
+                if kind == "summary":
+                    count, total = value
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_format_number(total)}")
+                elif kind == "counter":
+                    lines.append(f"{PREFIX}{name}_total{_format_labels(labels)} {_format_number(value)}")
+                else:
+                    lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically write a textfile for node_exporter's textfile collector, labelled with gpucost_job"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render(job_label=TEXTFILE_JOB_LABEL))
+        os.replace(tmp_path, path)
+
+    def push(self, gateway_url, timeout=10, **grouping):
+        """Replace this job's group on a Pushgateway-compatible endpoint; the grouping key sets the job label"""
+        path = f"/metrics/job/{quote(self.job, safe='')}"
+        for key, value in sorted(grouping.items()):
+            path += f"/{key}/{quote(str(value), safe='')}"
+        response = requests.put(
+            gateway_url.rstrip("/") + path,
+            data=self.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4"},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+
+    def export(self, textfile=None, pushgateway=None):
+        """Write and/or push the metrics; failures are printed, never raised"""
+        if textfile:
+            try:
+                self.write_textfile(textfile)
+                print(f"Wrote metrics to {textfile}")
+            except OSError as e:
+                print(f"Failed to write metrics textfile {textfile}: {e}")
+        if pushgateway:
+            try:
+                self.push(pushgateway)
+                print(f"Pushed metrics to {pushgateway}")
+            except requests.exceptions.RequestException as e:
+                print(f"Failed to push metrics to {pushgateway}: {e}")
+
+
+# Shared registry; each job names itself with configure() at startup
+metrics = JobMetrics()
+
+
+def configure(job):
+    metrics.job = job
+    return metrics
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument(
+        "--metrics-textfile",
+        default=os.environ.get("GPUCOST_METRICS_TEXTFILE"),
+        help="write per-stage timings and counters to this textfile (node_exporter textfile collector format)",
+    )
+    parser.add_argument(
+        "--pushgateway",
+        default=os.environ.get("GPUCOST_PUSHGATEWAY"),
+        help="push per-stage timings and counters to this Pushgateway-compatible URL",
+    )
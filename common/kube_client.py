@@ -0,0 +1,272 @@
+import atexit
+import base64
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+from job_metrics import metrics
+
+# kind -> (API group path, plural) for the resources the scripts manage
+RESOURCE_PATHS = {
+    "deployment": ("/apis/apps/v1", "deployments"),
+    "replicaset": ("/apis/apps/v1", "replicasets"),
+    "pod": ("/api/v1", "pods"),
+    "event": ("/api/v1", "events"),
+    "service": ("/api/v1", "services"),
+    "ingress": ("/apis/networking.k8s.io/v1", "ingresses"),
+}
+
+FIELD_MANAGER = "gpucost"
+
+_temp_files = []
+
+def _cleanup_temp_files():
+    for path in _temp_files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+atexit.register(_cleanup_temp_files)
+
+def _data_file(data_b64, suffix):
+    """Write base64 kubeconfig data to a private temp file, since requests wants paths"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        f.write(base64.b64decode(data_b64))
+    _temp_files.append(path)
+    return path
+
+
+class KubeApiError(Exception):
+    """Raised when the API server answers with an error status"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"Kubernetes API error {status_code}: {message}")
+        self.status_code = status_code
+
+
+class KubeClient:
+    """
+    Minimal Kubernetes API client over one keep-alive session per cluster
+
+    Covers what the model-test scripts need: list with selectors, get, the
+    scale subresource, delete and server-side apply. Point it at any server
+    (e.g. a local fake) with the constructor, or use from_kubeconfig.
+    """
+
+    def __init__(self, server, token=None, verify=True, cert=None, namespace="default", token_provider=None, timeout=30):
+        self.server = server.rstrip("/")
+        self.namespace = namespace
+        self.timeout = timeout
+        self._token = token
+        self._token_provider = token_provider
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.session.verify = verify
+        if cert is not None:
+            self.session.cert = cert
+
+    @classmethod
+    def from_kubeconfig(cls, context=None, path=None):
+        """Build a client for a kubeconfig context (the current context if None)"""
+        path = path or os.environ.get("KUBECONFIG", os.path.expanduser("~/.kube/config")).split(os.pathsep)[0]
+        with open(path) as f:
+            config = yaml.safe_load(f)
+
+        context = context or config.get("current-context")
+        contexts = {c["name"]: c["context"] for c in config.get("contexts", [])}
+        if context not in contexts:
+            raise ValueError(f"Context {context} not found in {path}")
+        ctx = contexts[context]
+        cluster = {c["name"]: c["cluster"] for c in config.get("clusters", [])}[ctx["cluster"]]
+        user = {u["name"]: u.get("user", {}) for u in config.get("users", [])}.get(ctx.get("user"), {})
+
+        if cluster.get("insecure-skip-tls-verify"):
+            verify = False
+        elif "certificate-authority-data" in cluster:
+            verify = _data_file(cluster["certificate-authority-data"], ".crt")
+        else:
+            verify = cluster.get("certificate-authority", True)
+
+        cert = None
+        if "client-certificate-data" in user:
+            cert = (
+                _data_file(user["client-certificate-data"], ".crt"),
+                _data_file(user["client-key-data"], ".key"),
+            )
+        elif "client-certificate" in user:
+            cert = (user["client-certificate"], user["client-key"])
+
+        token_provider = ExecCredentialProvider(user["exec"]) if "exec" in user else None
+        return cls(
+            cluster["server"],
+            token=user.get("token"),
+            verify=verify,
+            cert=cert,
+            namespace=ctx.get("namespace", "default"),
+            token_provider=token_provider,
+        )
+
+    def _headers(self, content_type=None):
+        headers = {"Accept": "application/json"}
+        token = self._token_provider.token() if self._token_provider else self._token
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        if content_type:
+            headers["Content-Type"] = content_type
+        return headers
+
+    def _path(self, kind, namespace=None, name=None, subresource=None, api_path=None, plural=None):
+        if api_path is None:
+            api_path, plural = RESOURCE_PATHS[kind.lower()]
+        path = f"{api_path}/namespaces/{namespace or self.namespace}/{plural}"
+        if name:
+            path += f"/{name}"
+        if subresource:
+            path += f"/{subresource}"
+        return path
+
+    def request(self, method, path, params=None, body=None, content_type=None):
+        metrics.inc("queries", backend="kubernetes")
+        response = self.session.request(
+            method,
+            self.server + path,
+            params=params,
+            data=body,
+            headers=self._headers(content_type),
+            timeout=self.timeout,
+        )
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise KubeApiError(response.status_code, message)
+        metrics.inc("bytes_downloaded", len(response.content), backend="kubernetes")
+        return response.json() if response.content else {}
+
+    def list(self, kind, namespace=None, label_selector=None, field_selector=None):
+        """List objects of a kind; returns the List object with its 'items'"""
+        params = {}
+        if label_selector:
+            params["labelSelector"] = label_selector
+        if field_selector:
+            params["fieldSelector"] = field_selector
+        return self.request("GET", self._path(kind, namespace), params=params)
+
+    def watch(self, kind, namespace=None, resource_version=None, timeout_seconds=300):
+        """
+        Stream watch events ({"type": ..., "object": ...}) for a kind
+
+        Ends when the server closes the watch after timeout_seconds; callers
+        resume from the last seen resourceVersion.
+        """
+        metrics.inc("queries", backend="kubernetes")
+        params = {"watch": "1", "timeoutSeconds": str(timeout_seconds), "allowWatchBookmarks": "true"}
+        if resource_version:
+            params["resourceVersion"] = resource_version
+        response = self.session.get(
+            self.server + self._path(kind, namespace),
+            params=params,
+            headers=self._headers(),
+            stream=True,
+            timeout=(self.timeout, timeout_seconds + self.timeout),
+        )
+        with response:
+            if response.status_code >= 400:
+                raise KubeApiError(response.status_code, response.text)
+            for line in response.iter_lines():
+                if line:
+                    metrics.inc("bytes_downloaded", len(line), backend="kubernetes")
+                    yield json.loads(line)
+
+    def get(self, kind, name, namespace=None):
+        return self.request("GET", self._path(kind, namespace, name))
+
+    def scale(self, kind, name, replicas, namespace=None):
+        """Patch the scale subresource, like kubectl scale"""
+        body = json.dumps({"spec": {"replicas": replicas}})
+        return self.request(
+            "PATCH",
+            self._path(kind, namespace, name, "scale"),
+            body=body,
+            content_type="application/merge-patch+json",
+        )
+
+    def delete(self, kind, name, namespace=None, ignore_not_found=True):
+        """Delete an object; returns False if it did not exist and ignore_not_found is set"""
+        try:
+            self.request("DELETE", self._path(kind, namespace, name))
+            return True
+        except KubeApiError as e:
+            if ignore_not_found and e.status_code == 404:
+                return False
+            raise
+
+    def apply(self, manifest, field_manager=FIELD_MANAGER, force=True):
+        """Server-side apply a single manifest dict"""
+        api_version = manifest["apiVersion"]
+        kind = manifest["kind"]
+        metadata = manifest["metadata"]
+        if kind.lower() in RESOURCE_PATHS:
+            api_path, plural = RESOURCE_PATHS[kind.lower()]
+        else:
+            api_path = f"/api/{api_version}" if "/" not in api_version else f"/apis/{api_version}"
+            plural = kind.lower() + "s"
+        path = self._path(kind, metadata.get("namespace"), metadata["name"], api_path=api_path, plural=plural)
+        return self.request(
+            "PATCH",
+            path,
+            params={"fieldManager": field_manager, "force": "true" if force else "false"},
+            body=json.dumps(manifest),
+            content_type="application/apply-patch+yaml",
+        )
+
+
+class ExecCredentialProvider:
+    """Runs a kubeconfig exec plugin (e.g. doctl) and caches the token until it expires"""
+
+    def __init__(self, exec_config):
+        self.exec_config = exec_config
+        self._token = None
+        self._expires_at = None
+        self._lock = threading.Lock()
+
+    def token(self):
+        with self._lock:
+            if self._token is None or (
+                self._expires_at is not None and datetime.now(timezone.utc) >= self._expires_at
+            ):
+                self._refresh()
+            return self._token
+
+    def _refresh(self):
+        env = dict(os.environ)
+        for item in self.exec_config.get("env") or []:
+            env[item["name"]] = item["value"]
+        cmd = [self.exec_config["command"]] + list(self.exec_config.get("args") or [])
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=True, env=env)
+        status = json.loads(proc.stdout).get("status", {})
+        self._token = status["token"]
+        expiry = status.get("expirationTimestamp")
+        self._expires_at = datetime.fromisoformat(expiry.replace("Z", "+00:00")) if expiry else None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(context=None):
+    """Return the shared client for a kubeconfig context, creating it on first use"""
+    with _clients_lock:
+        if context not in _clients:
+            _clients[context] = KubeClient.from_kubeconfig(context)
+        return _clients[context]
@@ -0,0 +1,165 @@
+import codecs
+import json
+import math
+import re
+from array import array
+
+from job_metrics import metrics
+
+_RESULT_START = re.compile(r'"result"\s*:\s*\[')
+_decoder = json.JSONDecoder()
+
+
+class PromQueryError(Exception):
+    """Raised when Prometheus reports a failed query or the payload cannot be read"""
+
+
+class PromSeries:
+    """One result series with its samples decoded into compact float arrays"""
+    __slots__ = ("metric", "timestamps", "values")
+
+    def __init__(self, metric, timestamps, values):
+        self.metric = metric
+        self.timestamps = timestamps
+        self.values = values
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def samples(self):
+        return zip(self.timestamps, self.values)
+
+
+def _to_series(obj):
+    if "values" in obj:
+        samples = obj["values"]
+    elif "value" in obj:
+        samples = [obj["value"]]
+    else:
+        samples = []
+    timestamps = array("d", (float(sample[0]) for sample in samples))
+    values = array("d", (float(sample[1]) for sample in samples))
+    return PromSeries(obj.get("metric", {}), timestamps, values)
+
+
+def iter_result_series(chunks):
+    """
+    Incrementally decode a Prometheus query response
+
+    Parameters:
+        chunks: Iterable of bytes, e.g. response.iter_content(65536)
+
+    Yields:
+        PromSeries, one per element of data.result, without ever holding the
+        decoded form of more than one series
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    exhausted = False
+
+    def fill():
+        nonlocal buffer, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += utf8.decode(b"", final=True)
+            exhausted = True
+        else:
+            buffer += utf8.decode(chunk)
+
+    # Skip the envelope up to the opening bracket of data.result
+    while True:
+        match = _RESULT_START.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        if exhausted:
+            try:
+                body = json.loads(buffer)
+            except ValueError:
+                raise PromQueryError("Response does not contain a result array")
+            raise PromQueryError(body.get("error", "Unknown error"))
+        fill()
+
+    position = 0
+    while True:
+        # Skip separators between series
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) or exhausted:
+                break
+            fill()
+        if position >= len(buffer):
+            raise PromQueryError("Response ended inside the result array")
+        if buffer[position] == "]":
+            return
+        try:
+            obj, end = _decoder.raw_decode(buffer, position)
+        except ValueError:
+            if exhausted:
+                raise PromQueryError("Malformed series in result array")
+            # Double the buffer before retrying so a huge series is re-scanned only O(log n) times
+            target = 2 * len(buffer)
+            while len(buffer) < target and not exhausted:
+                fill()
+            continue
+        if not isinstance(obj, dict):
+            raise PromQueryError("Only vector and matrix results can be streamed")
+        yield _to_series(obj)
+        buffer = buffer[end:]
+        position = 0
+
+
+# Queries longer than this are sent as a POST form body to stay under URL length limits
+MAX_GET_QUERY_LENGTH = 4096
+
+
+def stream_query(session, url, params, timeout=10, chunk_size=65536):
+    """
+    Run a Prometheus query and yield its result series one at a time
+
+    Raises:
+        requests exceptions for transport/HTTP errors, PromQueryError for
+        query errors reported by Prometheus
+    """
+    metrics.inc("queries", backend="prometheus")
+    if len(params.get("query", "")) > MAX_GET_QUERY_LENGTH:
+        response = session.post(url, data=params, timeout=timeout, stream=True)
+    else:
+        response = session.get(url, params=params, timeout=timeout, stream=True)
+    with response:
+        if response.status_code >= 400:
+            # Error bodies are small and carry Prometheus' message
+            try:
+                message = response.json().get("error", response.text)
+            except ValueError:
+                message = response.text
+            raise PromQueryError(f"HTTP {response.status_code}: {message}")
+        yield from iter_result_series(_counting(response.iter_content(chunk_size)))
+
+
+def _counting(chunks):
+    """Pass chunks through, adding their size to the downloaded-bytes counter"""
+    for chunk in chunks:
+        metrics.inc("bytes_downloaded", len(chunk), backend="prometheus")
+        yield chunk
+
+
+def series_to_legacy(series):
+    """Convert a PromSeries to the {"metric", "values"} dict response.json() would give"""
+    return {
+        "metric": series.metric,
+        "values": [[ts, format_value(value)] for ts, value in series.samples()],
+    }
+
+
+def format_value(value):
+    """Render a float the way Prometheus does, so int() keeps working on counts"""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
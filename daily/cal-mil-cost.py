@@ -1,58 +1,217 @@
+import argparse
+import csv
+import json
+import numpy as np
+import cost_engine
 import dbutils
+import token_sources
 from dbutils import GPUHourCost
-from prom_utils import query_prometheus_with_custom_range
+from job_metrics import add_metrics_arguments, configure
+from prom_utils import (
+    parse_step_seconds,
+    parse_time_seconds,
+    query_gpu_counts_grouped,
+)
 from datetime import datetime, timedelta
 
-def cal_gpu_oneday_total_cost(hourly_cost, gpu_hour_nums_list):
-    total_cost = 0.0
-    for hour_data in gpu_hour_nums_list:
-        timestamp, gpu_hour_num_str = hour_data
-        gpu_hour_num = int(gpu_hour_num_str)
-        hour_cost = hourly_cost * gpu_hour_num
-        total_cost += hour_cost
-    return total_cost
+parser = argparse.ArgumentParser()
+parser.add_argument("--start", help="first day to backfill (YYYY-MM-DD); defaults to yesterday")
+parser.add_argument("--end", help="last day to backfill, inclusive (YYYY-MM-DD); defaults to --start")
+parser.add_argument("--output", help="write the per-day cost history to this CSV file")
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="always query StarRocks instead of reusing cached finished days",
+)
+parser.add_argument(
+    "--update",
+    action="store_true",
+    help="in backfill mode, also write the last day's costs to ProviderTokenCost",
+)
+parser.add_argument(
+    "--token-source",
+    choices=["starrocks", "prometheus", "reconcile"],
+    default="starrocks",
+    help="where token counts come from: StarRocks only, vllm counters for the providers in "
+    "--token-selectors (StarRocks for the rest), or StarRocks checked against the counters",
+)
+parser.add_argument(
+    "--token-selectors",
+    help="JSON file mapping provider id to the PromQL label selector of its vllm metrics",
+)
+add_metrics_arguments(parser)
 
+metrics = configure("cal-mil-cost")
+
+# Provider id -> label selector of its vllm metrics; extended by --token-selectors
+prometheus_token_selectors={}
 
 hourly_gpu_cost_ids2cluster={
     'kaon-v1-12b-ex': 'k8s/exabits-h100/dcgm-exporter',
     'kaon-v1-12b-exca': 'k8s/exabits-ca/dcgm-exporter',
 }
 
-yesterday = datetime.now() - timedelta(days=1)
-yesterday = yesterday.strftime("%Y-%m-%d")
-today = datetime.now().strftime("%Y-%m-%d")
-
-matched_records, unmatched_ids = dbutils.get_matched_records(yesterday)
-print(f"Query Records for {yesterday}:")
-
-for record in matched_records:
-    print(f"Matched Record: {record}")
-if len(unmatched_ids) > 0:
-    print(f"Unmatched IDs: {unmatched_ids}")
-
-pg_conn = dbutils.get_pgdb_connection()
-
-for record in matched_records:
-    id = record.id
-    gpudatas = dbutils.get_by_cluster(pg_conn, id)
-    if len(gpudatas) > 1:
-        raise ValueError(f"Error: GPU data for ID {id} is not unique.")
-    if len(gpudatas) == 0:
-        print(f"Warning: No GPU data found for ID {id}.")
-        continue
-    gpuhourdata: GPUHourCost = gpudatas[0]
-    if id in hourly_gpu_cost_ids2cluster.keys():
-        prom_cluster = hourly_gpu_cost_ids2cluster[id]
-        gpu_hour_nums_list = query_prometheus_with_custom_range(yesterday,today,job=prom_cluster)
-        print(f"GPU hour nums list for ID {id}: {gpu_hour_nums_list}")
-        gpu_cost = cal_gpu_oneday_total_cost(gpuhourdata.price, gpu_hour_nums_list)
-        print(f"Calculated GPU cost for ID {id} using Prometheus data: {gpu_cost}")
-    else:
-        gpu_cost = gpuhourdata.price * gpuhourdata.card_num * 24
-    input_mil_cost = gpu_cost / (record.input_tokens + 5 * record.output_tokens) * 1000000
-    input_mil_cost = round(input_mil_cost, 3)
-    output_mil_cost = round(input_mil_cost * 5, 3)
-    print(f"ID: {id}, gpu cost: {gpu_cost}, Input MIL Cost: {input_mil_cost}, Output MIL Cost: {output_mil_cost}")
-    dbutils.update_providercost_table(pg_conn, id, input_mil_cost, output_mil_cost)
-
-pg_conn.close()
+def day_range(start_day, end_day):
+    """All days from start_day to end_day inclusive, as YYYY-MM-DD strings"""
+    start = datetime.strptime(start_day, "%Y-%m-%d")
+    end = datetime.strptime(end_day, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+def next_day(day):
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+def fetch_prometheus_gpu_costs(ids, days, catalog, step="1h"):
+    """
+    GPU cost per day for providers billed from Prometheus GPU counts
+
+    One grouped range query covers every cluster and every day.
+
+    Returns:
+        Dict mapping provider id to {day: gpu cost}
+    """
+    start_day, end_day = days[0], next_day(days[-1])
+    values_by_id = query_gpu_counts_grouped(
+        start_day, end_day, {id: hourly_gpu_cost_ids2cluster[id] for id in ids}, step_hours=step
+    )
+
+    step_seconds = parse_step_seconds(step)
+    start_ts = parse_time_seconds(f"{start_day}T00:00:00+08:00")
+    end_ts = parse_time_seconds(f"{end_day}T00:00:00+08:00")
+    grid = cost_engine.step_grid(start_ts, end_ts, step_seconds)
+
+    series = []
+    for id in ids:
+        if values_by_id[id] is None:
+            raise ValueError(f"Failed to fetch GPU counts for ID {id} from Prometheus")
+        series.append(values_by_id[id])
+    gpu_counts = cost_engine.align_series(series, grid)
+    hours = cost_engine.gpu_hours(gpu_counts, step_seconds, samples_per_day=len(grid) // len(days))
+    costs = cost_engine.gpu_costs([catalog.get(id).price for id in ids], hours)
+    return {id: dict(zip(days, costs[row].tolist())) for row, id in enumerate(ids)}
+
+def price_days(start_day, end_day, catalog, token_source):
+    """
+    Per-million-token costs for every matched provider and day in the range
+
+    Token counts come from token_source, GPU counts from one grouped
+    Prometheus query, and all costs are computed in one vectorized pass.
+
+    Returns:
+        List of (event_date, id, gpu_cost, input_mil_cost, output_mil_cost),
+        ordered by day
+    """
+    days = day_range(start_day, end_day)
+    with metrics.span("token_counts"):
+        matched_records, unmatched_ids = token_source.get(start_day, end_day)
+    print(f"Query Records for {start_day} to {end_day}:")
+
+    for record in matched_records:
+        print(f"Matched Record: {record}")
+    if len(unmatched_ids) > 0:
+        print(f"Unmatched IDs: {unmatched_ids}")
+
+    priced_records = []
+    with metrics.span("gpu_catalog"):
+        for record in matched_records:
+            gpuhourdata: GPUHourCost = catalog.get(record.id)
+            if gpuhourdata is None:
+                print(f"Warning: No GPU data found for ID {record.id}.")
+                continue
+            priced_records.append(record)
+
+    prom_ids = sorted({r.id for r in priced_records if r.id in hourly_gpu_cost_ids2cluster})
+    with metrics.span("prometheus_gpu_counts"):
+        prom_costs = fetch_prometheus_gpu_costs(prom_ids, days, catalog) if prom_ids else {}
+
+    with metrics.span("compute"):
+        gpus = [catalog.get(record.id) for record in priced_records]
+        fixed_costs = cost_engine.fixed_gpu_costs([g.price for g in gpus], [g.card_num for g in gpus])
+
+        gpu_costs = []
+        for record, fixed_cost in zip(priced_records, fixed_costs.tolist()):
+            id = record.id
+            if id in prom_costs:
+                gpu_cost = prom_costs[id][str(record.event_date)]
+                print(f"Calculated GPU cost for ID {id} on {record.event_date} using Prometheus data: {gpu_cost}")
+            else:
+                gpu_cost = fixed_cost
+            gpu_costs.append(gpu_cost)
+
+        input_mil_costs, output_mil_costs = cost_engine.mil_costs(
+            gpu_costs,
+            [record.input_tokens for record in priced_records],
+            [record.output_tokens for record in priced_records],
+        )
+
+        history = []
+        for record, gpu_cost, input_mil_cost, output_mil_cost in zip(
+            priced_records, gpu_costs, input_mil_costs.tolist(), output_mil_costs.tolist()
+        ):
+            id = record.id
+            if np.isnan(input_mil_cost):
+                print(f"Warning: No tokens recorded for ID {id} on {record.event_date}, skipping.")
+                continue
+            print(f"Date: {record.event_date}, ID: {id}, gpu cost: {gpu_cost}, Input MIL Cost: {input_mil_cost}, Output MIL Cost: {output_mil_cost}")
+            history.append((str(record.event_date), id, gpu_cost, input_mil_cost, output_mil_cost))
+            metrics.inc("records", provider=id)
+        history.sort(key=lambda row: (row[0], row[1]))
+    return history
+
+def latest_cost_updates(history):
+    """(id, inputCostMil, outputCostMil) for each provider's most recent day"""
+    latest = {}
+    for event_date, id, _, input_mil_cost, output_mil_cost in history:
+        latest[id] = (id, input_mil_cost, output_mil_cost)
+    return list(latest.values())
+
+def write_history_csv(path, history):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["event_date", "id", "gpu_cost", "inputCostMil", "outputCostMil"])
+        writer.writerows(history)
+    print(f"Wrote {len(history)} cost rows to {path}")
+
+def build_token_source(args, records_cache=None):
+    """Token source selected on the command line"""
+    starrocks = token_sources.StarRocksTokenSource(records_cache)
+    if args.token_source == "starrocks":
+        return starrocks
+    selectors = dict(prometheus_token_selectors)
+    if args.token_selectors:
+        with open(args.token_selectors) as f:
+            selectors.update(json.load(f))
+    return token_sources.CombinedTokenSource(
+        token_sources.PrometheusTokenSource(selectors),
+        starrocks,
+        reconcile=args.token_source == "reconcile",
+    )
+
+def main():
+    args = parser.parse_args()
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    backfill = args.start is not None
+    start_day = args.start or yesterday
+    end_day = args.end or start_day
+    if end_day < start_day:
+        raise ValueError("--end must not be before --start")
+
+    success = False
+    try:
+        with dbutils.pg_pool.connection() as pg_conn:
+            gpu_catalog = dbutils.GPUHourCostCatalog(pg_conn)
+            records_cache = None if args.no_cache else dbutils.MatchedRecordsCache()
+            token_source = build_token_source(args, records_cache)
+            history = price_days(start_day, end_day, gpu_catalog, token_source=token_source)
+            if args.output:
+                write_history_csv(args.output, history)
+            if not backfill or args.update:
+                with metrics.span("db_update"):
+                    dbutils.bulk_update_providercost_table(pg_conn, latest_cost_updates(history))
+        success = True
+    finally:
+        metrics.finish(success)
+        metrics.export(args.metrics_textfile, args.pushgateway)
+
+
+if __name__ == "__main__":
+    main()
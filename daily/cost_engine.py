@@ -0,0 +1,121 @@
+import numpy as np
+
+# Output tokens are priced at this multiple of input tokens
+OUTPUT_TOKEN_WEIGHT = 5
+# Per-million costs are stored with this many decimals
+COST_DECIMALS = 3
+
+
+def decode_values(values, dtype=np.float64):
+    """
+    Decode Prometheus samples into numeric arrays
+
+    Parameters:
+        values: A PromSeries (its arrays are used directly) or a list of
+            [timestamp, "value"] samples
+
+    Returns:
+        (timestamps, values) as contiguous float64 arrays
+    """
+    if hasattr(values, "timestamps"):
+        return np.asarray(values.timestamps, dtype=np.float64), np.asarray(values.values, dtype=dtype)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=dtype)
+    timestamps = np.fromiter((sample[0] for sample in values), dtype=np.float64, count=len(values))
+    numbers = np.fromiter((sample[1] for sample in values), dtype=dtype, count=len(values))
+    return timestamps, numbers
+
+
+def step_grid(start, end, step_seconds):
+    """Step-aligned timestamps in [start, end), matching the trimmed range query samples"""
+    return np.arange(start, end, step_seconds, dtype=np.float64)
+
+
+def align_series(series_list, grid):
+    """
+    Place many providers' samples on a shared time grid
+
+    Parameters:
+        series_list: One PromSeries (or Prometheus values list) per provider
+        grid: Sorted array of step-aligned timestamps
+
+    Returns:
+        (providers x len(grid)) float64 matrix; steps without a sample are 0,
+        which is what a missing count() sample means for GPU billing
+    """
+    matrix = np.zeros((len(series_list), len(grid)), dtype=np.float64)
+    for row, values in enumerate(series_list):
+        timestamps, numbers = decode_values(values)
+        if len(timestamps) == 0:
+            continue
+        columns = np.searchsorted(grid, timestamps)
+        inside = columns < len(grid)
+        inside[inside] = grid[columns[inside]] == timestamps[inside]
+        matrix[row, columns[inside]] = numbers[inside]
+    return matrix
+
+
+def gpu_hours(gpu_counts, step_seconds=3600, samples_per_day=None):
+    """
+    GPU-hours per provider, or per provider and day
+
+    Counts are summed before being scaled by the step length, so whole-GPU
+    counts accumulate exactly regardless of summation order.
+
+    Parameters:
+        gpu_counts: (providers x steps) matrix of GPU counts
+        samples_per_day: When given, return a (providers x days) matrix
+    """
+    gpu_counts = np.asarray(gpu_counts, dtype=np.float64)
+    if samples_per_day is not None:
+        providers, steps = gpu_counts.shape
+        gpu_counts = gpu_counts.reshape(providers, steps // samples_per_day, samples_per_day)
+    return gpu_counts.sum(axis=-1) * (step_seconds / 3600)
+
+
+def gpu_costs(hourly_prices, hours):
+    """Cost of each provider's GPU-hours; hourly_prices has one entry per provider"""
+    prices = np.asarray(hourly_prices, dtype=np.float64)
+    hours = np.asarray(hours, dtype=np.float64)
+    return hours * prices.reshape((-1,) + (1,) * (hours.ndim - 1))
+
+
+def fixed_gpu_costs(hourly_prices, card_nums, hours=24):
+    """Cost of providers billed for a fixed number of cards all day"""
+    return np.asarray(hourly_prices, dtype=np.float64) * np.asarray(card_nums, dtype=np.float64) * hours
+
+
+def round_cost(costs, decimals=COST_DECIMALS):
+    """
+    Round costs with Python's round() at a fixed number of decimals
+
+    np.round scales before rounding and can disagree with round() on stored
+    values (np.round(0.0125, 3) is 0.012, round(0.0125, 3) is 0.013), so each
+    element goes through round() to keep ProviderTokenCost values unchanged.
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    rounded = [round(cost, decimals) for cost in costs.ravel().tolist()]
+    return np.array(rounded, dtype=np.float64).reshape(costs.shape)
+
+
+def mil_costs(total_costs, input_tokens, output_tokens, output_weight=OUTPUT_TOKEN_WEIGHT):
+    """
+    Per-million-token input and output costs
+
+    The input price is the cost spread over input tokens plus weighted output
+    tokens; the output price is the rounded input price times the weight.
+    Entries without any tokens come back as NaN.
+
+    Returns:
+        (input_mil_costs, output_mil_costs), rounded with round_cost
+    """
+    total_costs = np.asarray(total_costs, dtype=np.float64)
+    weighted_tokens = (
+        np.asarray(input_tokens, dtype=np.float64)
+        + output_weight * np.asarray(output_tokens, dtype=np.float64)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        input_mil = np.where(weighted_tokens > 0, total_costs / weighted_tokens * 1000000, np.nan)
+    input_mil = round_cost(input_mil)
+    output_mil = round_cost(input_mil * output_weight)
+    return input_mil, output_mil
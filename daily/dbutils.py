@@ -1,12 +1,27 @@
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor  # For returning query results in dictionary format
+from psycopg2.extras import execute_values
 from dataclasses import dataclass
-from typing import List
+from typing import Collection, Dict, Iterator, List, Optional
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import atexit
+import csv
+import hashlib
+import io
+import json
 import logging
+import os
+import threading
+import time
+import sys
 import mysql.connector
 from mysql.connector import Error
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from job_metrics import metrics
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -15,6 +30,75 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class ConnectionPool:
+    """
+    Small thread-safe connection pool shared by the helpers below.
+
+    Connections are checked out with `with pool.connection() as conn:`,
+    health-checked when they have sat idle for longer than ping_interval,
+    reset when returned and discarded if the reset fails.
+    """
+
+    def __init__(self, connect, is_healthy, reset, max_size: int = 4, ping_interval: float = 30):
+        self._connect = connect
+        self._is_healthy = is_healthy
+        self._reset = reset
+        self.max_size = max_size
+        self.ping_interval = ping_interval
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Failed to close pooled connection: {e}")
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if time.monotonic() - returned_at < self.ping_interval:
+                return conn
+            try:
+                if self._is_healthy(conn):
+                    return conn
+            except Exception as e:
+                logger.warning(f"Pooled connection failed health check: {e}")
+            self._discard(conn)
+            metrics.inc("retries", operation="db_reconnect")
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, blocking while max_size are in use"""
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        finally:
+            if conn is not None:
+                try:
+                    self._reset(conn)
+                    with self._lock:
+                        self._idle.append((conn, time.monotonic()))
+                except Exception as e:
+                    logger.warning(f"Discarding pooled connection: {e}")
+                    self._discard(conn)
+            self._slots.release()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
 MYSQL_CONFIG = {
     'host': '18.189.20.30',    
     'user': 'flowgptwq',       
@@ -34,20 +118,50 @@ def get_mysql_connection():
         print(f"Connection failed: {e}")
         return None
 
+def _connect_mysql():
+    conn = get_mysql_connection()
+    if conn is None:
+        raise ValueError("Failed to establish database connection")
+    return conn
+
+def _mysql_is_healthy(conn):
+    conn.ping(reconnect=False)
+    return True
+
+def _mysql_reset(conn):
+    # Raises if an unbuffered result was left unread, which discards the connection
+    conn.rollback()
+
+mysql_pool = ConnectionPool(_connect_mysql, _mysql_is_healthy, _mysql_reset)
+atexit.register(mysql_pool.close_all)
+
 @dataclass
 class TokenCostResult:
     """Data class to encapsulate matched joined results"""
+    __slots__ = ("id", "input_tokens", "output_tokens", "event_date")
     id: str
     input_tokens: int
     output_tokens: int
     event_date: str
 
-def get_matched_records(event_date: str):
-    """
-    Perform left join and return only matched records.
-    Logs errors for unmatched records from ProviderTokenCost.
-    """
-    query = f"""
+def _id_list(ids: Collection[str]) -> str:
+    return ", ".join("'" + str(id).replace("\\", "\\\\").replace("'", "''") + "'" for id in sorted(ids))
+
+def _matched_records_query(
+    event_date: str,
+    end_date: Optional[str] = None,
+    ids: Optional[Collection[str]] = None,
+    exclude_ids: Optional[Collection[str]] = None,
+) -> str:
+    if end_date is None:
+        date_filter = f"tclmr.event_date='{event_date}'"
+    else:
+        date_filter = f"tclmr.event_date BETWEEN '{event_date}' AND '{end_date}'"
+    if ids is not None:
+        date_filter += f" and ptc.id IN ({_id_list(ids)})"
+    if exclude_ids:
+        date_filter += f" and ptc.id NOT IN ({_id_list(exclude_ids)})"
+    return f"""
         SELECT 
             ptc.id, 
             tclmr.input_tokens, 
@@ -61,48 +175,227 @@ def get_matched_records(event_date: str):
             flow_report_app.tbl_chat_llm_model_request tclmr
             ON ptc.model = tclmr.model_id 
             AND ptc.url = tclmr.request_url
-        where ptc.active = true and tclmr.event_date='{event_date}';
+        where ptc.active = true and {date_filter};
+    """
+
+def iter_matched_records(
+    event_date: str,
+    end_date: Optional[str] = None,
+    batch_size: int = 1000,
+    err_ids: Optional[List[str]] = None,
+    ids: Optional[Collection[str]] = None,
+    exclude_ids: Optional[Collection[str]] = None,
+) -> Iterator[List[TokenCostResult]]:
+    """
+    Stream matched records in batches from an unbuffered cursor.
+    Logs errors for unmatched records from ProviderTokenCost and appends
+    their ids to err_ids when a list is given.
+
+    When end_date is given, records for every day from event_date to
+    end_date (inclusive) are fetched in a single query. ids restricts the
+    query to those providers and exclude_ids leaves those providers out.
+    """
+    if ids is not None and not ids:
+        return
+    query = _matched_records_query(event_date, end_date, ids, exclude_ids)
+
+    with mysql_pool.connection() as conn:
+        cur = None
+        try:
+            # Unbuffered: rows stay on the server until fetched batch by batch
+            cur = conn.cursor(dictionary=True, buffered=False)
+            metrics.inc("queries", backend="starrocks")
+            cur.execute(query)
+
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                metrics.inc("rows_fetched", len(rows), backend="starrocks")
+                batch = []
+                for row in rows:
+                    # Check if there was a match in the right table
+                    if row['input_tokens'] is None or row['output_tokens'] is None:
+                        # Log unmatched record
+                        logger.error(
+                            f"No matching record found in tbl_chat_llm_model_request for "
+                            f"ProviderTokenCost ID: {row['id']}, Model: {row['model']}, URL: {row['url']}"
+                        )
+                        if err_ids is not None:
+                            err_ids.append(row['id'])
+                    else:
+                        batch.append(TokenCostResult(
+                            id=row['id'],
+                            input_tokens=row['input_tokens'],
+                            output_tokens=row['output_tokens'],
+                            event_date=row['event_date']
+                        ))
+                if batch:
+                    yield batch
+
+        except mysql.connector.Error as e:
+            logger.error(f"Database query error: {str(e)}")
+            raise e
+        finally:
+            # Closing an unbuffered cursor with unread rows (consumer stopped early)
+            # can fail; the pool then discards the connection on return
+            try:
+                if cur:
+                    cur.close()
+            except mysql.connector.Error as e:
+                logger.warning(f"Failed to close MySQL cursor cleanly: {str(e)}")
+
+def get_matched_records(
+    event_date: str,
+    end_date: Optional[str] = None,
+    ids: Optional[Collection[str]] = None,
+    exclude_ids: Optional[Collection[str]] = None,
+):
+    """
+    Perform left join and return only matched records.
+    Logs errors for unmatched records from ProviderTokenCost.
+
+    When end_date is given, records for every day from event_date to
+    end_date (inclusive) are fetched in a single query. ids and exclude_ids
+    restrict the providers as in iter_matched_records.
     """
-    
     matched_results = []
     err_ids = []
-    conn = get_mysql_connection()
+    for batch in iter_matched_records(event_date, end_date, err_ids=err_ids, ids=ids, exclude_ids=exclude_ids):
+        matched_results.extend(batch)
+    return matched_results, err_ids
 
-    if conn is None:
-        raise ValueError("Failed to establish database connection")
+# Local cache of matched records for days whose StarRocks data is final
+MATCHED_RECORDS_CACHE_DIR = os.environ.get(
+    "MATCHED_RECORDS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpucost", "starrocks")
+)
+MATCHED_RECORDS_VIEW = "flow_rds_prod.view_ai_prod_provider_token_cost"
 
+def get_view_version(view_name: str = MATCHED_RECORDS_VIEW) -> Optional[str]:
+    """Return a hash of the view definition, or None if it cannot be read"""
     try:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(query)
-
-        for row in cur.fetchall():
-            # Check if there was a match in the right table
-            if row['input_tokens'] is None or row['output_tokens'] is None:
-                # Log unmatched record
-                logger.error(
-                    f"No matching record found in tbl_chat_llm_model_request for "
-                    f"ProviderTokenCost ID: {row['id']}, Model: {row['model']}, URL: {row['url']}"
-                )
-                err_ids.append(row['id'])
+        with mysql_pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SHOW CREATE VIEW {view_name}")
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return hashlib.sha1(row[1].encode("utf-8")).hexdigest()[:16]
+    except (mysql.connector.Error, ValueError) as e:
+        logger.error(f"Failed to read definition of view {view_name}: {str(e)}")
+        return None
+
+class MatchedRecordsCache:
+    """
+    Per-day cache of get_matched_records results, keyed by query, date and
+    view version.
+
+    Days older than revalidate_days are treated as final and served from
+    disk; recent days are always re-queried and never persisted. Hits and
+    misses are counted per day.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, revalidate_days: int = 2, view_version: Optional[str] = None):
+        self.cache_dir = cache_dir or MATCHED_RECORDS_CACHE_DIR
+        self.revalidate_days = revalidate_days
+        self.view_version = view_version if view_version is not None else get_view_version()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, day: str) -> str:
+        # The query text with a placeholder date, so editing the SQL invalidates the cache
+        query_template = _matched_records_query("{event_date}")
+        key = f"{query_template}\x00{day}\x00{self.view_version}"
+        return os.path.join(self.cache_dir, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json")
+
+    def _is_final(self, day: str) -> bool:
+        cutoff = (datetime.now() - timedelta(days=self.revalidate_days)).strftime("%Y-%m-%d")
+        # Without a view version a changed view could go unnoticed, so nothing is final
+        return self.view_version is not None and day < cutoff
+
+    def _load(self, day: str) -> Optional[List[TokenCostResult]]:
+        try:
+            with open(self._path(day)) as f:
+                rows = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return [TokenCostResult(*row) for row in rows]
+
+    def _store(self, day: str, records: List[TokenCostResult]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(day)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([[r.id, r.input_tokens, r.output_tokens, r.event_date] for r in records], f)
+        os.replace(tmp_path, path)
+
+    def get(
+        self,
+        event_date: str,
+        end_date: Optional[str] = None,
+        ids: Optional[Collection[str]] = None,
+        exclude_ids: Optional[Collection[str]] = None,
+    ):
+        """
+        Same contract as get_matched_records; only days missing from the cache
+        are queried, with a single BETWEEN query spanning them.
+        Unmatched ids are only reported for the days actually queried.
+        ids and exclude_ids are applied locally to final days, which are
+        always fetched for every provider so they can be stored; only recent
+        days are queried with the provider filter.
+        """
+        def wanted(id):
+            return (ids is None or id in ids) and not (exclude_ids and id in exclude_ids)
+
+        filtered = ids is not None or bool(exclude_ids)
+        end_date = end_date or event_date
+        start = datetime.strptime(event_date, "%Y-%m-%d")
+        days = [
+            (start + timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range((datetime.strptime(end_date, "%Y-%m-%d") - start).days + 1)
+        ]
+
+        by_day = {}
+        missing = []
+        for day in days:
+            cached = self._load(day) if self._is_final(day) else None
+            if cached is None:
+                missing.append(day)
             else:
-                # Add matched record to results
-                matched_results.append(TokenCostResult(
-                    id=row['id'],
-                    input_tokens=row['input_tokens'],
-                    output_tokens=row['output_tokens'],
-                    event_date=row['event_date']
-                ))
-        
-        return matched_results, err_ids
-        
-    except mysql.connector.Error as e:  # 修改为MySQL的错误处理
-        logger.error(f"Database query error: {str(e)}")
-        raise e
-    finally:
-        if cur:
-            cur.close()
-        if conn:  # 添加连接关闭
-            conn.close()
+                by_day[day] = [record for record in cached if wanted(record.id)]
+        self.hits += len(days) - len(missing)
+        self.misses += len(missing)
+
+        # One query for every missing day, unless a provider filter is set:
+        # then final days are fetched unfiltered (to be stored) and recent days filtered
+        if filtered:
+            groups = [
+                ([day for day in missing if self._is_final(day)], None, None),
+                ([day for day in missing if not self._is_final(day)], ids, exclude_ids),
+            ]
+        else:
+            groups = [(missing, None, None)]
+
+        err_ids = []
+        for group, group_ids, group_exclude_ids in groups:
+            if not group:
+                continue
+            first, last = group[0], group[-1]
+            fetched, group_err_ids = get_matched_records(
+                first, None if first == last else last, group_ids, group_exclude_ids
+            )
+            err_ids.extend(id for id in group_err_ids if wanted(id))
+            fetched_by_day = {day: [] for day in group}
+            for record in fetched:
+                record.event_date = str(record.event_date)
+                if record.event_date in fetched_by_day:
+                    fetched_by_day[record.event_date].append(record)
+            for day, records in fetched_by_day.items():
+                if self._is_final(day):
+                    self._store(day, records)
+                by_day[day] = [record for record in records if wanted(record.id)]
+
+        print(f"Matched records cache: {self.hits} hits, {self.misses} misses")
+        return [record for day in days for record in by_day[day]], err_ids
 
 @dataclass
 class GPUHourCost:
@@ -137,12 +430,27 @@ def get_pgdb_connection():
         print(f"Database connection failed: {e}")
         raise
 
+def _pg_is_healthy(conn):
+    if conn.closed:
+        return False
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    return True
+
+def _pg_reset(conn):
+    if conn.closed:
+        raise psycopg2.InterfaceError("connection already closed")
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    conn.autocommit = True
+
+pg_pool = ConnectionPool(get_pgdb_connection, _pg_is_healthy, _pg_reset)
+atexit.register(pg_pool.close_all)
+
 def get_all_table_names():
     """Retrieve and print all table names in the current database"""
-    conn = None
     try:
-        conn = get_pgdb_connection()
-        with conn.cursor() as cur:
+        with pg_pool.connection() as conn, conn.cursor() as cur:
             # Query to get all table names in the public schema
             cur.execute("""
                 SELECT table_name 
@@ -164,15 +472,10 @@ def get_all_table_names():
     except Exception as e:
         print(f"Failed to retrieve table names: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 def create_table():
     """Create example table (users table)"""
-    conn = None
     try:
-        conn = get_pgdb_connection()
-        with conn.cursor() as cur:
+        with pg_pool.connection() as conn, conn.cursor() as cur:
             # Use sql.Identifier to prevent SQL injection (when dynamically generating table/column names)
             table_name = sql.Identifier("users")
             # Create table SQL
@@ -189,16 +492,11 @@ def create_table():
             print("Table created successfully (if it didn't exist)")
     except Exception as e:
         print(f"Failed to create table: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def insert_gpu_table(model, cluster, card_num, price):
     """Insert data into GPUHourCost table"""
-    conn = None
     try:
-        conn = get_pgdb_connection()
-        with conn.cursor() as cur:
+        with pg_pool.connection() as conn, conn.cursor() as cur:
             insert_sql = """
                 INSERT INTO public."GPUHourCost" (model, cluster, "cardNum", price)
                 VALUES (%s, %s, %s, %s)
@@ -210,16 +508,11 @@ def insert_gpu_table(model, cluster, card_num, price):
         print(f"Insert failed: Model={model}, Card Number={card_num} already exists (unique constraint)")
     except Exception as e:
         print(f"Failed to insert data: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def query_gpu_table(model=None, min_price=None, max_price=None):
     """Query data with optional filters"""
-    conn = None
     try:
-        conn = get_pgdb_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with pg_pool.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
             query_conditions = []
             params = []
             
@@ -259,28 +552,80 @@ def query_gpu_table(model=None, min_price=None, max_price=None):
             return results
     except Exception as e:
         print(f"Failed to query data: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
-def batch_insert_gpu_table(data_list, table_name):
-    """Batch insert multiple records"""
-    conn = None
+class _CopyStream:
+    """File-like object that renders rows as CSV on demand, so COPY never needs the full list"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+            self.count += 1
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+def copy_rows(table_name, columns, rows, conflict_columns=None):
+    """
+    Bulk load rows into a table with COPY ... FROM STDIN
+
+    :param table_name: Target table, as it should appear in SQL
+    :param columns: Column names, as they should appear in SQL
+    :param rows: Any iterable of row tuples; consumed lazily
+    :param conflict_columns: When given, rows are copied into a staging table
+                             and upserted on these columns instead
+    :return: Number of rows loaded
+    """
+    column_list = ", ".join(columns)
+    stream = _CopyStream(rows)
+    with pg_pool.connection() as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                if conflict_columns is None:
+                    cur.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT csv)", stream)
+                else:
+                    cur.execute(f"""
+                        CREATE TEMP TABLE copy_stage
+                        (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP;
+                    """)
+                    cur.copy_expert(f"COPY copy_stage ({column_list}) FROM STDIN WITH (FORMAT csv)", stream)
+                    updates = ", ".join(
+                        f"{column} = EXCLUDED.{column}" for column in columns if column not in conflict_columns
+                    )
+                    on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+                    cur.execute(f"""
+                        INSERT INTO {table_name} ({column_list})
+                        SELECT {column_list} FROM copy_stage
+                        ON CONFLICT ({", ".join(conflict_columns)}) {on_conflict};
+                    """)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return stream.count
+
+def batch_insert_gpu_table(data_list, table_name, conflict_columns=None):
+    """Batch insert multiple records (any iterable of tuples) using COPY"""
     try:
-        conn = get_pgdb_connection()
-        with conn.cursor() as cur:
-            insert_sql = f"""
-                INSERT INTO {table_name} (model, cluster, "cardNum", "price")
-                VALUES (%s, %s, %s, %s);
-            """
-            cur.executemany(insert_sql, data_list)
-            print(f"Batch insertion successful, inserted {len(data_list)} records")
+        count = copy_rows(table_name, ["model", "cluster", '"cardNum"', '"price"'], data_list, conflict_columns)
+        print(f"Batch insertion successful, inserted {count} records")
     except Exception as e:
         print(f"Failed to batch insert: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def update_providercost_table(conn,id,inputmilcost,outputmilcost):
     """Update a record in the providercost table"""
@@ -297,23 +642,57 @@ def update_providercost_table(conn,id,inputmilcost,outputmilcost):
     except Exception as e:
         print(f"Failed to update record: {e}")
 
-def batch_insert_providercost_table(data_list, table_name):
-    """Batch insert multiple records"""
-    conn = None
+def bulk_update_providercost_table(conn, rows):
+    """
+    Update many records in the providercost table in a single transaction
+
+    :param rows: Iterable of (id, inputCostMil, outputCostMil) tuples
+    :return: Number of rows actually changed; rows whose stored costs
+             already match are skipped so they don't produce dead tuples
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    update_sql = """
+        UPDATE public."ProviderTokenCost" AS ptc
+        SET "inputCostMil" = v.input_cost, "outputCostMil" = v.output_cost
+        FROM (VALUES %s) AS v(id, input_cost, output_cost)
+        WHERE ptc.id = v.id
+        AND (ptc."inputCostMil", ptc."outputCostMil")
+            IS DISTINCT FROM (v.input_cost, v.output_cost);
+    """
+
+    autocommit = conn.autocommit
+    conn.autocommit = False
     try:
-        conn = get_pgdb_connection()
         with conn.cursor() as cur:
-            insert_sql = f"""
-                INSERT INTO {table_name} (id, url, model, "inputCostMil", "outputCostMil", active)
-                VALUES (%s, %s, %s, %s, %s, %s);
-            """
-            cur.executemany(insert_sql, data_list)
-            print(f"Batch insertion successful, inserted {len(data_list)} records")
+            # One page means one statement and one round trip for all rows
+            metrics.inc("queries", backend="postgres")
+            execute_values(cur, update_sql, rows, page_size=len(rows))
+            updated = cur.rowcount
+        conn.commit()
+        print(f"Bulk update successful, changed {updated} of {len(rows)} records")
+        return updated
     except Exception as e:
-        print(f"Failed to batch insert: {e}")
+        conn.rollback()
+        print(f"Failed to bulk update records: {e}")
+        raise
     finally:
-        if conn:
-            conn.close()
+        conn.autocommit = autocommit
+
+def batch_insert_providercost_table(data_list, table_name, conflict_columns=None):
+    """Batch insert multiple records (any iterable of tuples) using COPY"""
+    try:
+        count = copy_rows(
+            table_name,
+            ["id", "url", "model", '"inputCostMil"', '"outputCostMil"', "active"],
+            data_list,
+            conflict_columns,
+        )
+        print(f"Batch insertion successful, inserted {count} records")
+    except Exception as e:
+        print(f"Failed to batch insert: {e}")
 
 def get_by_cluster(conn, cluster: str) -> List[GPUHourCost]:
     """
@@ -357,4 +736,64 @@ def get_by_cluster(conn, cluster: str) -> List[GPUHourCost]:
             cursor.close()
 
 
+class GPUHourCostCatalog:
+    """
+    In-memory index of every GPUHourCost row keyed by cluster.
+
+    The whole table is loaded with one query and reloaded lazily once
+    ttl_seconds have passed, so per-record lookups never hit the database.
+    """
+
+    def __init__(self, conn, ttl_seconds: float = 300):
+        self.conn = conn
+        self.ttl_seconds = ttl_seconds
+        self._index: Dict[str, GPUHourCost] = {}
+        self._duplicates = set()
+        self._loaded_at = None
+
+    def refresh(self):
+        """Reload all GPUHourCost rows and rebuild the cluster index"""
+        query = """
+            SELECT model, cluster, "cardNum" as card_num, price
+            FROM "GPUHourCost"
+        """
+        index = {}
+        duplicates = set()
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            metrics.inc("queries", backend="postgres")
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            metrics.inc("rows_fetched", len(rows), backend="postgres")
+            for row in rows:
+                cluster = row['cluster']
+                if cluster in index:
+                    duplicates.add(cluster)
+                index[cluster] = GPUHourCost(
+                    model=row['model'],
+                    cluster=cluster,
+                    card_num=row['card_num'],
+                    price=row['price']
+                )
+
+        for cluster in sorted(duplicates):
+            logger.error(f"GPU data for cluster {cluster} is not unique")
+
+        self._index = index
+        self._duplicates = duplicates
+        self._loaded_at = time.monotonic()
+        print(f"Loaded {len(index)} GPU hour cost records")
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl_seconds:
+            self.refresh()
+
+    def get(self, cluster: str) -> Optional[GPUHourCost]:
+        """
+        Return the GPUHourCost for a cluster, or None if there is none.
 
+        :raises ValueError: if the cluster has more than one record
+        """
+        self._ensure_fresh()
+        if cluster in self._duplicates:
+            raise ValueError(f"Error: GPU data for ID {cluster} is not unique.")
+        return self._index.get(cluster)
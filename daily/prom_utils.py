@@ -1,29 +1,255 @@
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import time
+import sys
+from array import array
+import numpy as np
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from prom_stream import PromQueryError, PromSeries, series_to_legacy, stream_query
 
 proms_range_url="http://172.31.255.83:9090/api/v1/query_range"
-def query_prometheus_with_custom_range(
-    start_day_str, 
-    end_day_str, 
+
+# Day boundaries used by every daily query (the +08:00 in _day_range_params)
+PROM_DAY_TZ = timezone(timedelta(hours=8))
+
+# Shared keep-alive session; the pool is sized for query_prometheus_many
+MAX_CONCURRENT_QUERIES = 8
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=MAX_CONCURRENT_QUERIES, pool_maxsize=MAX_CONCURRENT_QUERIES))
+session.mount("https://", HTTPAdapter(pool_connections=MAX_CONCURRENT_QUERIES, pool_maxsize=MAX_CONCURRENT_QUERIES))
+
+def build_range_params(
+    start_day_str,
+    end_day_str,
     job="k8s/exabits-h100/dcgm-exporter",
     pod_regex="kaon-v1-12b.*",
     step_hours="1h",
 ):
-    
+    """Build query_range parameters counting the GPUs of a job over whole days"""
     query = f'count(DCGM_FI_DEV_DEC_UTIL{{job="{job}",pod=~"{pod_regex}"}})'
+    return _day_range_params(query, start_day_str, end_day_str, step_hours)
 
-    params = {
+def _day_range_params(query, start_day_str, end_day_str, step_hours):
+    return {
         "query": query,
         "start": f"{start_day_str}T00:00:00+08:00",
         "end": f"{end_day_str}T00:00:00+08:00",
         "step": step_hours,
     }
-    
-    data=query_prometheus(proms_range_url, params)
+
+def _promql_regex_literal(value):
+    """Escape a label value for use inside a double-quoted PromQL regex matcher"""
+    return re.escape(value).replace("\\", "\\\\")
+
+def plan_gpu_count_queries(
+    start_day_str,
+    end_day_str,
+    jobs,
+    pod_regex="kaon-v1-12b.*",
+    pod_regexes=None,
+    step_hours="1h",
+):
+    """
+    Combine provider/job pairs into one `count by (job)` range query per pod regex
+
+    Parameters:
+        jobs: Dict mapping provider id to Prometheus job
+        pod_regexes: Optional dict overriding pod_regex for some provider ids
+
+    Returns:
+        List of (query parameters, dict mapping job to the provider ids it bills)
+    """
+    pod_regexes = pod_regexes or {}
+    groups = {}
+    for key, job in jobs.items():
+        regex = pod_regexes.get(key, pod_regex)
+        groups.setdefault(regex, {}).setdefault(job, []).append(key)
+
+    plans = []
+    for regex, job_ids in groups.items():
+        job_regex = "|".join(_promql_regex_literal(job) for job in sorted(job_ids))
+        query = f'count by (job) (DCGM_FI_DEV_DEC_UTIL{{job=~"{job_regex}",pod=~"{regex}"}})'
+        plans.append((_day_range_params(query, start_day_str, end_day_str, step_hours), job_ids))
+    return plans
+
+def query_gpu_counts_grouped(
+    start_day_str,
+    end_day_str,
+    jobs,
+    pod_regex="kaon-v1-12b.*",
+    pod_regexes=None,
+    step_hours="1h",
+    max_workers=MAX_CONCURRENT_QUERIES,
+):
+    """
+    Fetch the GPU count series of many providers with as few queries as possible
+
+    Returns:
+        Dict mapping provider id to its untrimmed PromSeries (an empty one
+        if its job had no series), or None if its query failed
+    """
+    plans = plan_gpu_count_queries(start_day_str, end_day_str, jobs, pod_regex, pod_regexes, step_hours)
+    results = query_prometheus_many(
+        proms_range_url,
+        {index: params for index, (params, _) in enumerate(plans)},
+        max_workers=max_workers,
+        query_func=query_prometheus_cached,
+    )
+
+    values_by_id = {}
+    for index, (_, job_ids) in enumerate(plans):
+        data = results[index]
+        by_job = {} if data is None else {item.metric.get("job"): item for item in data}
+        for job, keys in job_ids.items():
+            for key in keys:
+                if data is None:
+                    values_by_id[key] = None
+                else:
+                    values_by_id[key] = by_job.get(job) or PromSeries({"job": job}, array("d"), array("d"))
+    return values_by_id
+
+TOKEN_COUNTERS = {
+    "input": "vllm:prompt_tokens_total",
+    "output": "vllm:generation_tokens_total",
+}
+
+def plan_token_count_query(start_day_str, end_day_str, selectors):
+    """
+    Build one range query for the daily token increases of many providers
+
+    Each provider's counters are summed under its own label selector and
+    tagged with provider and kind labels, so a single query covers every
+    provider and both counters. Samples are taken at each day's end
+    (00:00 +08:00 of the next day), each covering the preceding day.
+
+    Parameters:
+        selectors: Dict mapping provider id to a PromQL label selector body,
+            e.g. 'job="vllm",pod=~"kaon-v1-12b.*"'
+        end_day_str: Last day to cover, inclusive
+    """
+    parts = []
+    for key, selector in sorted(selectors.items()):
+        for kind, counter in TOKEN_COUNTERS.items():
+            parts.append(
+                f'label_replace(label_replace(sum(increase({counter}{{{selector}}}[1d])), '
+                f'"provider", "{key}", "", ""), "kind", "{kind}", "", "")'
+            )
+    query = " or ".join(parts)
+    first_end = datetime.strptime(start_day_str, "%Y-%m-%d") + timedelta(days=1)
+    last_end = datetime.strptime(end_day_str, "%Y-%m-%d") + timedelta(days=1)
+    return _day_range_params(query, first_end.strftime("%Y-%m-%d"), last_end.strftime("%Y-%m-%d"), "1d")
+
+def query_token_counts_grouped(start_day_str, end_day_str, selectors, timeout=30):
+    """
+    Daily input/output token counts of many providers from vllm counters
+
+    Returns:
+        Dict mapping provider id to {day: [input_tokens, output_tokens]},
+        with only the days Prometheus has samples for, or None if the query
+        failed
+    """
+    if not selectors:
+        return {}
+    series = query_prometheus_series(proms_range_url, plan_token_count_query(start_day_str, end_day_str, selectors), timeout)
+    if series is None:
+        return None
+
+    counts = {key: {} for key in selectors}
+    for s in series:
+        key = s.metric.get("provider")
+        if key not in counts:
+            continue
+        column = 0 if s.metric.get("kind") == "input" else 1
+        for ts, value in s.samples():
+            if math.isnan(value):
+                continue
+            # The sample at a day's end covers the day before it
+            day = (datetime.fromtimestamp(ts, PROM_DAY_TZ) - timedelta(days=1)).strftime("%Y-%m-%d")
+            counts[key].setdefault(day, [0, 0])[column] = int(round(value))
+    return counts
+
+def first_series_values(data):
+    """Return the samples of the first series, without the trailing end-of-range sample"""
     if data is None or len(data)==0:
         return []
-    return data[0]['values'][:-1]
+    return series_to_legacy(data[0])['values'][:-1]
+
+def query_prometheus_with_custom_range(
+    start_day_str, 
+    end_day_str, 
+    job="k8s/exabits-h100/dcgm-exporter",
+    pod_regex="kaon-v1-12b.*",
+    step_hours="1h",
+):
+    params = build_range_params(start_day_str, end_day_str, job, pod_regex, step_hours)
+    data=query_prometheus_cached(proms_range_url, params)
+    return first_series_values(data)
+
+def query_prometheus_many(
+    prometheus_url,
+    queries,
+    timeout=10,
+    max_workers=MAX_CONCURRENT_QUERIES,
+    query_func=None,
+):
+    """
+    Run several Prometheus queries concurrently over the shared session
+
+    Parameters:
+        prometheus_url: Query endpoint of the Prometheus server
+        queries: Dict mapping a key (e.g. provider id) to query parameters
+        timeout: Timeout in seconds for each query
+        max_workers: Maximum number of queries in flight at once
+        query_func: Function used for each query, defaults to query_prometheus
+
+    Returns:
+        Dict mapping each key to its parsed result, or None if that query failed
+    """
+    if not queries:
+        return {}
+    if query_func is None:
+        query_func = query_prometheus
+    workers = max(1, min(max_workers, len(queries)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            key: executor.submit(query_func, prometheus_url, params, timeout)
+            for key, params in queries.items()
+        }
+        return {key: future.result() for key, future in futures.items()}
 
 
+def query_prometheus_series(prometheus_url, params, timeout=10):
+    """
+    Query Prometheus and return the result series decoded into compact arrays
+
+    The response is decoded incrementally, so peak memory follows the largest
+    series rather than the whole payload.
+
+    Returns:
+        List of PromSeries, or None if an error occurs
+    """
+    try:
+        # Stream the response over the shared keep-alive session
+        return list(stream_query(session, prometheus_url, params, timeout))
+    except PromQueryError as e:
+        print(f"Query failed: {e}")
+    except requests.exceptions.ConnectionError:
+        print("Connection error, please check if Prometheus address is correct")
+    except requests.exceptions.Timeout:
+        print(f"Query timed out after {timeout} seconds")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+    return None
+
 def query_prometheus(prometheus_url, params, timeout=10):
     """
     Query Prometheus and return the results
@@ -36,31 +262,302 @@ def query_prometheus(prometheus_url, params, timeout=10):
     Returns:
         Parsed query results, or None if an error occurs
     """
+    series = query_prometheus_series(prometheus_url, params, timeout)
+    if series is None:
+        return None
+    return [series_to_legacy(s) for s in series]
+
+
+# Prometheus rejects range queries above 11000 points per series
+MAX_POINTS_PER_QUERY = 10000
+
+def split_range(start, end, step_seconds, max_points=MAX_POINTS_PER_QUERY):
+    """
+    Split [start, end] into step-aligned (start, end) chunks of at most max_points samples
+
+    Each chunk ends one step before the next one starts, so every sample
+    timestamp of the original range falls in exactly one chunk.
+    """
+    chunks = []
+    chunk_span = (max_points - 1) * step_seconds
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + chunk_span, end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + step_seconds
+    return chunks
+
+def query_prometheus_range_series(
+    prometheus_url,
+    params,
+    timeout=10,
+    max_points=MAX_POINTS_PER_QUERY,
+    max_workers=MAX_CONCURRENT_QUERIES,
+):
+    """
+    Range query that splits long windows into chunks fetched in parallel
+
+    Series are stitched back together by their labels in time order.
+
+    Returns:
+        List of PromSeries, or None if any chunk failed
+    """
+    step_seconds = parse_step_seconds(params["step"])
+    start = parse_time_seconds(params["start"])
+    end = parse_time_seconds(params["end"])
+    chunks = split_range(start, end, step_seconds, max_points)
+    if len(chunks) <= 1:
+        return query_prometheus_series(prometheus_url, params, timeout)
+
+    queries = {
+        index: dict(params, start=chunk_start, end=chunk_end)
+        for index, (chunk_start, chunk_end) in enumerate(chunks)
+    }
+    results = query_prometheus_many(
+        prometheus_url, queries, timeout, max_workers, query_func=query_prometheus_series
+    )
+    if any(data is None for data in results.values()):
+        return None
+
+    stitched = {}
+    for index in range(len(chunks)):
+        for series in results[index]:
+            key = _series_key(series.metric)
+            if key not in stitched:
+                stitched[key] = PromSeries(series.metric, series.timestamps, series.values)
+            else:
+                stitched[key].timestamps.extend(series.timestamps)
+                stitched[key].values.extend(series.values)
+    return list(stitched.values())
+
+# On-disk cache of step-aligned range query samples, one file per (query, step)
+PROM_CACHE_DIR = os.environ.get(
+    "PROM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gpucost", "prometheus")
+)
+PROM_CACHE_MAX_AGE_DAYS = 90
+PROM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_CACHE_MAGIC = b"PRC2"
+# One packed (series index, timestamp, value) record per cached sample
+_CACHE_RECORD_DTYPE = np.dtype([("index", "<u4"), ("ts", "<f8"), ("value", "<f8")])
+_STEP_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_step_seconds(step):
+    """Convert a Prometheus step such as "1h", "5m" or "30" to seconds"""
+    step = str(step).strip()
+    if step and step[-1] in _STEP_UNITS:
+        return float(step[:-1]) * _STEP_UNITS[step[-1]]
+    return float(step)
+
+def parse_time_seconds(value):
+    """Convert a Prometheus start/end parameter (RFC3339 or unix seconds) to unix seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
     try:
-        
-        # Send GET request
-        response = requests.get(prometheus_url, params=params, timeout=timeout)
-        response.raise_for_status()  # Will raise HTTPError for bad status codes
-        
-        # Parse JSON response
-        result = response.json()
-        
-        # Check response status
-        if result.get("status") == "success":
-            return result.get("data", {}).get("result", [])
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def _cache_path(cache_dir, query, step):
+    digest = hashlib.sha1(f"{query}\x00{step}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.bin")
+
+def _series_key(metric):
+    return tuple(sorted((metric or {}).items()))
+
+def _read_cache(path):
+    """
+    Read a cache file
+
+    Returns:
+        (series, known) where series maps a label key to (metric labels,
+        timestamps, values) as sorted float64 arrays and known is the set of
+        timestamps already fetched, including steps that had no samples
+    """
+    try:
+        with open(path, "rb") as f:
+            blob = f.read()
+    except FileNotFoundError:
+        return {}, set()
+    if not blob.startswith(_CACHE_MAGIC):
+        print(f"Ignoring unreadable Prometheus cache file {path}")
+        return {}, set()
+    offset = len(_CACHE_MAGIC)
+    (header_len,) = struct.unpack_from("<I", blob, offset)
+    offset += 4
+    metrics = json.loads(blob[offset:offset + header_len].decode("utf-8"))
+    offset += header_len
+    (known_count,) = struct.unpack_from("<I", blob, offset)
+    offset += 4
+    known = set(np.frombuffer(blob, dtype="<f8", count=known_count, offset=offset).tolist())
+    offset += 8 * known_count
+
+    # Records are written grouped by series and sorted by timestamp
+    records = np.frombuffer(blob, dtype=_CACHE_RECORD_DTYPE, offset=offset)
+    bounds = np.searchsorted(records["index"], np.arange(len(metrics) + 1))
+    series = {}
+    for index, metric in enumerate(metrics):
+        rows = records[bounds[index]:bounds[index + 1]]
+        series[_series_key(metric)] = (metric, rows["ts"].astype(np.float64), rows["value"].astype(np.float64))
+    return series, known
+
+def _write_cache(path, series, known):
+    metrics = [metric for metric, _, _ in series.values()]
+    header = json.dumps(metrics, sort_keys=True).encode("utf-8")
+    known = np.array(sorted(known), dtype="<f8")
+    records = np.empty(sum(len(ts) for _, ts, _ in series.values()), dtype=_CACHE_RECORD_DTYPE)
+    position = 0
+    for index, (_, timestamps, values) in enumerate(series.values()):
+        end = position + len(timestamps)
+        records["index"][position:end] = index
+        records["ts"][position:end] = timestamps
+        records["value"][position:end] = values
+        position = end
+    parts = [
+        _CACHE_MAGIC,
+        struct.pack("<I", len(header)),
+        header,
+        struct.pack("<I", len(known)),
+        known.tobytes(),
+        records.tobytes(),
+    ]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(parts))
+    os.replace(tmp_path, path)
+
+def _missing_runs(grid, known):
+    """Group grid timestamps absent from the cache into contiguous runs"""
+    runs = []
+    current = []
+    for ts in grid:
+        if ts in known:
+            if current:
+                runs.append(current)
+                current = []
         else:
-            print(f"Query failed: {result.get('error', 'Unknown error')}")
+            current.append(ts)
+    if current:
+        runs.append(current)
+    return runs
+
+def _merge_samples(timestamps, values, new_timestamps, new_values):
+    """Merge fetched samples into cached ones; fetched values win on equal timestamps"""
+    timestamps = np.concatenate([np.asarray(new_timestamps, dtype=np.float64), timestamps])
+    values = np.concatenate([np.asarray(new_values, dtype=np.float64), values])
+    timestamps, first = np.unique(timestamps, return_index=True)
+    return timestamps, values[first]
+
+def query_prometheus_cached(
+    prometheus_url,
+    params,
+    timeout=10,
+    cache_dir=None,
+    settle_seconds=None,
+):
+    """
+    Range query backed by an incremental on-disk cache keyed by (query, step)
+
+    Only step-aligned timestamps missing from the cache are requested from
+    Prometheus; samples older than settle_seconds (default: one step) are
+    considered final and persisted. Samples stay in float64 arrays from the
+    response through the cache to the caller.
+
+    Returns:
+        List of PromSeries restricted to the requested grid, or None if a
+        needed fetch failed
+    """
+    cache_dir = cache_dir or PROM_CACHE_DIR
+    query = params["query"]
+    step_seconds = parse_step_seconds(params["step"])
+    start = parse_time_seconds(params["start"])
+    end = parse_time_seconds(params["end"])
+    if settle_seconds is None:
+        settle_seconds = step_seconds
+
+    grid = []
+    ts = start
+    while ts <= end:
+        grid.append(ts)
+        ts += step_seconds
+
+    path = _cache_path(cache_dir, query, params["step"])
+    series, known = _read_cache(path)
+    empty = np.empty(0, dtype=np.float64)
+
+    final_before = time.time() - settle_seconds
+    fetched_any = False
+    for run in _missing_runs(grid, known):
+        run_params = dict(params, start=run[0], end=run[-1])
+        data = query_prometheus_range_series(prometheus_url, run_params, timeout)
+        if data is None:
             return None
-            
-    except requests.exceptions.HTTPError as e:
-        print(f"HTTP error occurred: {e}")
-    except requests.exceptions.ConnectionError:
-        print("Connection error, please check if Prometheus address is correct")
-    except requests.exceptions.Timeout:
-        print(f"Query timed out after {timeout} seconds")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    return None
+        for item in data:
+            key = _series_key(item.metric)
+            metric, timestamps, values = series.get(key, (item.metric, empty, empty))
+            series[key] = (metric, *_merge_samples(timestamps, values, item.timestamps, item.values))
+        # Anything not yet settled is served but never persisted
+        settled = [ts for ts in run if ts < final_before]
+        known.update(settled)
+        fetched_any = fetched_any or bool(settled)
+
+    grid_array = np.array(grid, dtype=np.float64)
+    result = []
+    for metric, timestamps, values in series.values():
+        on_grid = np.isin(timestamps, grid_array)
+        if on_grid.any():
+            result.append(PromSeries(
+                metric, array("d", timestamps[on_grid].tobytes()), array("d", values[on_grid].tobytes())
+            ))
+
+    if fetched_any:
+        persisted = {}
+        for key, (metric, timestamps, values) in series.items():
+            settled = timestamps < final_before
+            if settled.any():
+                persisted[key] = (metric, timestamps[settled], values[settled])
+        _write_cache(path, persisted, {t for t in known if t < final_before})
+        evict_prometheus_cache(cache_dir)
+
+    return result
+
+def evict_prometheus_cache(cache_dir=None, max_age_days=PROM_CACHE_MAX_AGE_DAYS, max_bytes=PROM_CACHE_MAX_BYTES):
+    """
+    Remove cache files untouched for max_age_days, then the least recently
+    written ones until the cache fits in max_bytes
+
+    Returns:
+        Number of files removed
+    """
+    cache_dir = cache_dir or PROM_CACHE_DIR
+    try:
+        names = [n for n in os.listdir(cache_dir) if n.endswith(".bin")]
+    except FileNotFoundError:
+        return 0
+
+    entries = []
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+
+    removed = 0
+    cutoff = time.time() - max_age_days * 86400
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
 
 if __name__ == "__main__":
     start_time = "2025-12-01"
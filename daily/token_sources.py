@@ -0,0 +1,191 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Collection, Dict, List, Optional
+
+import dbutils
+from dbutils import TokenCostResult
+from prom_utils import query_token_counts_grouped
+
+logger = logging.getLogger(__name__)
+
+# Relative difference above which the two sources are reported as disagreeing
+RECONCILE_TOLERANCE = 0.02
+
+
+class StarRocksTokenSource:
+    """
+    Token counts from the ProviderTokenCost / request-log join in StarRocks
+
+    Covers every active provider. Finished days are served from
+    records_cache when one is given.
+    """
+
+    def __init__(self, records_cache: Optional[dbutils.MatchedRecordsCache] = None):
+        self.records_cache = records_cache
+
+    def get(self, start_day: str, end_day: str, ids: Optional[Collection[str]] = None, exclude_ids: Optional[Collection[str]] = None):
+        """Same contract as dbutils.get_matched_records, optionally restricted to some providers"""
+        if self.records_cache is not None:
+            return self.records_cache.get(start_day, end_day, ids, exclude_ids)
+        return dbutils.get_matched_records(start_day, None if start_day == end_day else end_day, ids, exclude_ids)
+
+
+class PrometheusTokenSource:
+    """
+    Token counts from the vllm prompt/generation counters of self-hosted providers
+
+    Only providers listed in selectors are covered; all of them are fetched
+    with one grouped query.
+    """
+
+    def __init__(self, selectors: Dict[str, str]):
+        self.selectors = selectors
+
+    def get(self, start_day: str, end_day: str):
+        """
+        Returns:
+            (records, unmatched_ids) like dbutils.get_matched_records, where
+            unmatched ids are covered providers without counters on any day
+            of the range; None if the query failed
+        """
+        counts = query_token_counts_grouped(start_day, end_day, self.selectors)
+        if counts is None:
+            return None
+        records = []
+        unmatched = []
+        for key in sorted(counts):
+            if not counts[key]:
+                unmatched.append(key)
+            for day, (input_tokens, output_tokens) in sorted(counts[key].items()):
+                if start_day <= day <= end_day:
+                    records.append(TokenCostResult(
+                        id=key, input_tokens=input_tokens, output_tokens=output_tokens, event_date=day
+                    ))
+        records.sort(key=lambda record: (record.event_date, record.id))
+        return records, unmatched
+
+
+def reconcile_records(primary: List[TokenCostResult], reference: List[TokenCostResult], tolerance: float = RECONCILE_TOLERANCE):
+    """
+    Compare token counts for the provider-days present in both sources
+
+    Returns:
+        List of (event_date, id, field, primary value, reference value) for
+        every count whose relative difference exceeds tolerance, plus
+        (event_date, id, "missing", ...) for provider-days only one side has
+    """
+    primary_by_key = {(str(r.event_date), r.id): r for r in primary}
+    reference_by_key = {(str(r.event_date), r.id): r for r in reference}
+    discrepancies = []
+    for key in sorted(primary_by_key.keys() | reference_by_key.keys()):
+        ours, theirs = primary_by_key.get(key), reference_by_key.get(key)
+        if ours is None or theirs is None:
+            discrepancies.append((*key, "missing", ours is not None, theirs is not None))
+            continue
+        for field in ("input_tokens", "output_tokens"):
+            a, b = getattr(ours, field), getattr(theirs, field)
+            if abs(a - b) > tolerance * max(abs(a), abs(b), 1):
+                discrepancies.append((*key, field, a, b))
+    return discrepancies
+
+
+class CombinedTokenSource:
+    """
+    Prometheus counters for the providers they cover, StarRocks for the rest
+
+    StarRocks is queried for the uncovered providers only, concurrently with
+    Prometheus, so the daily job waits for the slower of the two rather than
+    their sum. Provider-days a covered provider has no counters for are then
+    filled from a second StarRocks query restricted to those providers; a
+    covered provider is only reported unmatched if neither source has counts
+    for it. If the Prometheus query fails, the covered providers are fetched
+    from StarRocks instead. If StarRocks fails, the job continues with the
+    Prometheus-covered providers only.
+
+    With reconcile set, StarRocks is queried for every provider and stays
+    authoritative; the Prometheus counts are only compared against it.
+    """
+
+    def __init__(self, prometheus: PrometheusTokenSource, starrocks: StarRocksTokenSource, reconcile: bool = False, tolerance: float = RECONCILE_TOLERANCE):
+        self.prometheus = prometheus
+        self.starrocks = starrocks
+        self.reconcile = reconcile
+        self.tolerance = tolerance
+        self.discrepancies = []
+
+    def get(self, start_day: str, end_day: str):
+        """Same contract as dbutils.get_matched_records"""
+        covered = set(self.prometheus.selectors)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            prom_future = executor.submit(self.prometheus.get, start_day, end_day)
+            starrocks_future = executor.submit(
+                self.starrocks.get, start_day, end_day, exclude_ids=None if self.reconcile else covered
+            )
+            prom_result = prom_future.result()
+            try:
+                starrocks_result = starrocks_future.result()
+            except Exception as e:
+                if self.reconcile or prom_result is None:
+                    raise
+                logger.error(f"StarRocks token query failed, using Prometheus-covered providers only: {str(e)}")
+                starrocks_result = None
+
+        if self.reconcile:
+            if prom_result is None:
+                logger.error("Prometheus token query failed, nothing to reconcile")
+            else:
+                self._log_discrepancies(prom_result[0], [r for r in starrocks_result[0] if r.id in covered])
+            return starrocks_result
+
+        if prom_result is None:
+            logger.error("Prometheus token query failed, falling back to StarRocks")
+            covered_records, covered_unmatched = self.starrocks.get(start_day, end_day, ids=covered)
+            records = starrocks_result[0] + covered_records
+            records.sort(key=lambda record: (str(record.event_date), record.id))
+            return records, starrocks_result[1] + covered_unmatched
+        if starrocks_result is None:
+            return prom_result
+
+        prom_records, _ = prom_result
+        starrocks_records, starrocks_unmatched = starrocks_result
+        records = starrocks_records + prom_records + self._fill_gaps(start_day, end_day, prom_records, covered)
+        records.sort(key=lambda record: (str(record.event_date), record.id))
+        with_counts = {r.id for r in records}
+        unmatched = starrocks_unmatched + sorted(id for id in covered if id not in with_counts)
+        return records, unmatched
+
+    def _fill_gaps(self, start_day: str, end_day: str, prom_records: List[TokenCostResult], covered: Collection[str]):
+        """StarRocks records for the covered provider-days Prometheus has no counters for"""
+        start = datetime.strptime(start_day, "%Y-%m-%d")
+        days = [
+            (start + timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range((datetime.strptime(end_day, "%Y-%m-%d") - start).days + 1)
+        ]
+        have = {(str(r.event_date), r.id) for r in prom_records}
+        gaps = {(day, id) for id in covered for day in days if (day, id) not in have}
+        if not gaps:
+            return []
+        try:
+            records, _ = self.starrocks.get(start_day, end_day, ids={id for _, id in gaps})
+        except Exception as e:
+            logger.error(f"StarRocks token query for provider-days without counters failed: {str(e)}")
+            return []
+        filled = [r for r in records if (str(r.event_date), r.id) in gaps]
+        print(f"Token sources: filled {len(filled)} of {len(gaps)} provider-days without counters from StarRocks")
+        return filled
+
+    def _log_discrepancies(self, prom_records: List[TokenCostResult], starrocks_records: List[TokenCostResult]):
+        self.discrepancies = reconcile_records(prom_records, starrocks_records, self.tolerance)
+        for event_date, id, field, prom_value, starrocks_value in self.discrepancies:
+            if field == "missing":
+                logger.warning(
+                    f"Token counts for ID {id} on {event_date} only in "
+                    f"{'Prometheus' if prom_value else 'StarRocks'}"
+                )
+                continue
+            logger.warning(
+                f"Token count mismatch for ID {id} on {event_date} ({field}): "
+                f"Prometheus {prom_value}, StarRocks {starrocks_value}"
+            )
+        print(f"Token sources: {len(self.discrepancies)} discrepancies between Prometheus and StarRocks")
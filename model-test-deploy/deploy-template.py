@@ -1,12 +1,43 @@
 from string import Template
 import argparse
-import subprocess
+import itertools
+import json
+import math
+import os
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import requests
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "daily"))
+from kube_client import KubeApiError, get_client
+from prom_stream import stream_query
+
+PROMETHEUS_URL = "http://172.31.255.83:9090"
+prom_session = requests.Session()
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--id")
 parser.add_argument("--model")
 parser.add_argument("--device")
+parser.add_argument("--context", help="kubeconfig context to deploy to (default: current context)")
 parser.add_argument("--list", action="store_true",help="list all deployment which startswith 'model-test'")
+parser.add_argument(
+    "--batch",
+    help="YAML/JSON list of {id, model, device, context} entries to deploy in one run",
+)
+parser.add_argument("--workers", type=int, default=4, help="contexts applied in parallel in batch mode")
+parser.add_argument("--measure", action="store_true", help="after deploying, record time-to-ready per phase")
+parser.add_argument("--results", default="./coldstart-results.jsonl", help="JSON Lines file for --measure results")
+parser.add_argument("--timeout", type=int, default=1800, help="seconds to wait for readiness in --measure mode")
+parser.add_argument("--summarize", action="store_true", help="print cold-start percentiles from --results and exit")
+parser.add_argument("--sweep", help="YAML/JSON sweep spec: deploy a grid of vLLM serving parameters and rank them by cost")
+parser.add_argument("--sweep-results", default="./sweep-results.json", help="where --sweep writes its ranking")
+parser.add_argument("--keep", action="store_true", help="keep sweep deployments instead of deleting them afterwards")
+parser.add_argument("--prometheus-url", default=PROMETHEUS_URL, help="Prometheus used by --sweep")
 # 新增用于调整副本的参数
 parser.add_argument(
     "--scale-name",
@@ -20,64 +51,509 @@ parser.add_argument(
 
 def list_model_test_deployments() -> list[str]:
     """
-    调用 kubectl 列出集群中所有 deployment 名称，返回以 'model-test' 开头的名称列表。
+    通过 Kubernetes API 列出集群中所有 deployment 名称，返回以 'model-test' 开头的名称列表。
     """
-    cmd = [
-        "kubectl",
-        "get",
-        "deployments",
-    ]
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-    except FileNotFoundError:
-        print("kubectl not found in PATH")
-        return []
-    if proc.returncode != 0:
-        stderr = proc.stderr.strip()
-        print(f"kubectl error (rc={proc.returncode}): {stderr}")
+        data = get_client().list("deployment")
+    except Exception as e:
+        print(f"kubernetes api error: {e}")
         return []
-    lines = [ln.strip() for ln in proc.stdout.splitlines() if ln.strip()]
-    print(lines[0])
-    filtered = [name for name in lines if name.startswith("model-test")]
+    names = [item["metadata"]["name"] for item in data.get("items", [])]
+    filtered = [name for name in names if name.startswith("model-test")]
     return filtered
 
 def scale_deployment(deployment_name: str, replicas: int) -> bool:
     if replicas < 0:
         print("replicas must be >= 0")
         return False
-    cmd = ["kubectl", "scale", "deployment", deployment_name, f"--replicas={replicas}"]
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-    except FileNotFoundError:
-        print("kubectl not found in PATH")
-        return False
-    if proc.returncode != 0:
-        stderr = proc.stderr.strip()
-        print(f"kubectl scale error (rc={proc.returncode}): {stderr}")
+        get_client().scale("deployment", deployment_name, replicas)
+    except Exception as e:
+        print(f"scale error: {e}")
         return False
     print(f"Scaled deployment '{deployment_name}' to {replicas} replicas.")
     return True
 
-def deploy_model(model_name: str, model_id: str, dev: str) -> int:
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "deployment-test-template.yaml")
+
+def load_template(template_path: str = TEMPLATE_PATH) -> Template:
+    with open(template_path) as f:
+        return Template(f.read())
+
+# vLLM 服务参数名 -> 命令行参数；模板中的取值即默认值
+SERVING_PARAM_FLAGS = {
+    "max_model_len": "--max-model-len",
+    "max_num_seqs": "--max-num-seqs",
+    "max_num_batched_tokens": "--max-num-batched-tokens",
+    "quantization": "--quantization",
+    "kv_cache_dtype": "--kv-cache-dtype",
+}
+
+def set_serving_params(manifest: dict, serving: dict) -> None:
     """
-    使用给定的模型名称和 ID 部署模型。
+    覆盖 Deployment 中 vllm 容器的服务参数；取值为 None 时删除该参数（如不量化）。
     """
-    template_path="./deployment-test-template.yaml"
-    template = Template(open(template_path).read())
+    for name in serving:
+        if name not in SERVING_PARAM_FLAGS:
+            raise ValueError(f"unknown serving parameter {name}")
+    for container in manifest["spec"]["template"]["spec"]["containers"]:
+        args = container.get("args") or []
+        for name, value in serving.items():
+            flag = SERVING_PARAM_FLAGS[name]
+            if flag in args:
+                position = args.index(flag)
+                del args[position:position + 2]
+            if value is not None:
+                args.extend([flag, str(value)])
+        container["args"] = args
 
-    temp_yaml=template.substitute(
+def render_manifests(template: Template, model_id: str, model_name: str, dev: str, serving: dict = None) -> list[dict]:
+    """
+    在内存中渲染模板，返回其中的各个资源（Deployment、Service、Ingress）。
+    serving 可覆盖模板中的 vllm 服务参数（见 SERVING_PARAM_FLAGS）。
+    """
+    rendered = template.substitute(
         identifier=model_id,
         modelname=model_name,
         device=dev
     )
+    manifests = [manifest for manifest in yaml.safe_load_all(rendered) if manifest]
+    if serving:
+        for manifest in manifests:
+            if manifest["kind"] == "Deployment":
+                set_serving_params(manifest, serving)
+    return manifests
+
+def apply_manifests(manifests: list[dict], context: str = None) -> int:
+    """
+    通过同一个 keep-alive 连接依次 server-side apply 一组资源，全部成功返回 0，否则返回 1。
+    """
+    client = get_client(context)
+    returncode = 0
+    for manifest in manifests:
+        resource = f"{manifest['kind'].lower()}/{manifest['metadata']['name']}"
+        try:
+            client.apply(manifest)
+            print(f"{resource} applied" + (f" in context {context}" if context else ""))
+        except Exception as e:
+            print(f"apply error for {resource}: {e}")
+            returncode = 1
+    return returncode
+
+def deploy_model(model_name: str, model_id: str, dev: str, context: str = None) -> int:
+    """
+    使用给定的模型名称和 ID 部署模型（server-side apply，不写临时文件）。
+    """
+    manifests = render_manifests(load_template(), model_id, model_name, dev)
+    returncode = apply_manifests(manifests, context)
+    print(f"deployment return code {returncode}")
+    return returncode
+
+def load_batch_manifest(path: str) -> list[dict]:
+    """
+    读取批量部署清单（YAML 或 JSON 列表），每项包含 id、model、device，可选 context。
+    """
+    with open(path) as f:
+        entries = yaml.safe_load(f) or []
+    for entry in entries:
+        missing = [key for key in ("id", "model", "device") if not entry.get(key)]
+        if missing:
+            raise ValueError(f"batch entry {entry} is missing {', '.join(missing)}")
+    return entries
+
+def deploy_batch(entries: list[dict], max_workers: int = 4) -> dict:
+    """
+    批量部署：模板只解析一次，按 context 分组后各 context 并行 apply。
+    返回每个 context 的返回码（0 表示全部成功）。
+    """
+    template = load_template()
+    bundles = {}
+    for entry in entries:
+        manifests = render_manifests(template, str(entry["id"]), entry["model"], entry["device"])
+        bundles.setdefault(entry.get("context"), []).extend(manifests)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(bundles) or 1))) as executor:
+        futures = {context: executor.submit(apply_manifests, manifests, context) for context, manifests in bundles.items()}
+        results = {context: future.result() for context, future in futures.items()}
+
+    for context, returncode in results.items():
+        print(f"context {context or '(current)'}: return code {returncode}")
+    return results
+
+PHASES = ["schedule", "image_pull", "container_start", "ready"]
+
+def _parse_time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def _condition_time(pod: dict, condition_type: str):
+    for condition in pod.get("status", {}).get("conditions") or []:
+        if condition.get("type") == condition_type and condition.get("status") == "True":
+            return _parse_time(condition.get("lastTransitionTime"))
+    return None
+
+def pod_milestones(pod: dict, events: list[dict]) -> dict:
+    """
+    从 pod 状态和事件中提取各阶段的时间点（均为 API server 记录的时间）。
+    """
+    milestones = {
+        "created": _parse_time(pod.get("metadata", {}).get("creationTimestamp")),
+        "scheduled": _condition_time(pod, "PodScheduled"),
+        "ready": _condition_time(pod, "Ready"),
+        "pulling": None,
+        "pulled": None,
+        "started": None,
+    }
+    for status in pod.get("status", {}).get("containerStatuses") or []:
+        running = (status.get("state") or {}).get("running")
+        if running:
+            milestones["started"] = _parse_time(running.get("startedAt"))
+    for event in events:
+        when = _parse_time(event.get("eventTime") or event.get("firstTimestamp") or event.get("lastTimestamp"))
+        if event.get("reason") == "Pulling" and milestones["pulling"] is None:
+            milestones["pulling"] = when
+        elif event.get("reason") == "Pulled":
+            # "already present on machine" 时没有 Pulling 事件，拉取耗时记为 0
+            milestones["pulled"] = _parse_time(event.get("lastTimestamp")) or when
+            if milestones["pulling"] is None:
+                milestones["pulling"] = milestones["pulled"]
+    return milestones
+
+def phase_durations(milestones: dict, applied_at: datetime) -> dict:
+    """
+    将时间点换算为各阶段耗时（秒）；applied_at 为本机时钟，仅用于总耗时。
+    """
+    def seconds(start, end):
+        if start is None or end is None:
+            return None
+        return max(0.0, (end - start).total_seconds())
+
+    pulled = milestones["pulled"] or milestones["scheduled"]
+    return {
+        "schedule": seconds(milestones["created"], milestones["scheduled"]),
+        "image_pull": seconds(milestones["pulling"], milestones["pulled"]),
+        "container_start": seconds(pulled, milestones["started"]),
+        "ready": seconds(milestones["started"], milestones["ready"]),
+        "total": seconds(applied_at, milestones["ready"]),
+    }
+
+REVISION_ANNOTATION = "deployment.kubernetes.io/revision"
+
+def current_pod_template_hash(client, deployment_name: str) -> str:
+    """
+    返回 deployment 当前 revision 对应 ReplicaSet 的 pod-template-hash；
+    控制器尚未处理最新 spec 或 ReplicaSet 尚未创建时返回 None。
+    """
+    try:
+        deployment = client.get("deployment", deployment_name)
+    except KubeApiError as e:
+        if e.status_code == 404:
+            return None
+        raise
+    metadata = deployment.get("metadata", {})
+    if deployment.get("status", {}).get("observedGeneration", 0) < metadata.get("generation", 0):
+        return None
+    revision = (metadata.get("annotations") or {}).get(REVISION_ANNOTATION)
+    for replicaset in client.list("replicaset", label_selector=f"app={deployment_name}").get("items", []):
+        rs_metadata = replicaset.get("metadata", {})
+        owned = any(ref.get("uid") == metadata.get("uid") for ref in rs_metadata.get("ownerReferences") or [])
+        if owned and (rs_metadata.get("annotations") or {}).get(REVISION_ANNOTATION) == revision:
+            return (rs_metadata.get("labels") or {}).get("pod-template-hash")
+    return None
+
+def deployment_generation(deployment_name: str, context: str = None) -> int:
+    """
+    返回 deployment 的 metadata.generation；deployment 不存在时返回 None。
+    """
+    try:
+        return get_client(context).get("deployment", deployment_name).get("metadata", {}).get("generation")
+    except KubeApiError as e:
+        if e.status_code == 404:
+            return None
+        raise
+
+def deployment_generations(targets: list[dict]) -> dict:
+    """
+    apply 之前记录每个 target（deployment、context）的 generation，供 measure_time_to_ready 判断 apply 是否改动了 deployment。
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(targets) or 1))) as executor:
+        generations = executor.map(lambda target: deployment_generation(target["deployment"], target.get("context")), targets)
+        return {target["deployment"]: generation for target, generation in zip(targets, generations)}
+
+def measure_time_to_ready(deployment_name: str, context: str = None, applied_at: datetime = None, timeout: int = 1800, poll_seconds: int = 5, generation_before: int = None) -> dict:
+    """
+    轮询 deployment 的 pod 直到 Ready（或超时），返回各阶段耗时。
+    时间点取自 API server 记录，轮询间隔不影响精度。
+    新 pod 按当前 revision 的 pod-template-hash 识别，不依赖本机与 API server 的时钟。
+    generation_before 为 apply 之前的 generation；apply 后 generation 未变说明没有新 pod，
+    结果的 cold_start 为 False，各阶段为 None。
+    """
+    client = get_client(context)
+    applied_at = applied_at or datetime.now(timezone.utc)
+    if generation_before is not None and deployment_generation(deployment_name, context) == generation_before:
+        return {"deployment": deployment_name, "timed_out": False, "cold_start": False, **{phase: None for phase in PHASES + ["total"]}}
+    deadline = time.monotonic() + timeout
+    pod = None
+    while time.monotonic() < deadline:
+        template_hash = current_pod_template_hash(client, deployment_name)
+        if template_hash is not None:
+            selector = f"app={deployment_name},pod-template-hash={template_hash}"
+            pods = client.list("pod", label_selector=selector).get("items", [])
+            pod = max(pods, key=lambda p: p["metadata"].get("creationTimestamp", ""), default=None)
+            if pod is not None and _condition_time(pod, "Ready") is not None:
+                break
+        time.sleep(poll_seconds)
+
+    if pod is None:
+        return {"deployment": deployment_name, "timed_out": True, "cold_start": True, **{phase: None for phase in PHASES + ["total"]}}
+    events = client.list("event", field_selector=f"involvedObject.name={pod['metadata']['name']}").get("items", [])
+    milestones = pod_milestones(pod, events)
+    durations = phase_durations(milestones, applied_at)
+    return {"deployment": deployment_name, "timed_out": milestones["ready"] is None, "cold_start": True, **durations}
+
+def measure_deployments(targets: list[dict], applied_at: datetime, results_path: str, timeout: int = 1800, generations_before: dict = None) -> list[dict]:
+    """
+    并行测量一组新部署的冷启动耗时，并追加写入 results_path（JSON Lines）。
+    targets 的每项包含 deployment、context、model、device、image；
+    generations_before 为 deployment_generations 在 apply 之前的结果，apply 未改动的 deployment 不写入结果。
+    """
+    generations_before = generations_before or {}
+
+    def measure(target):
+        record = measure_time_to_ready(
+            target["deployment"], target.get("context"), applied_at, timeout,
+            generation_before=generations_before.get(target["deployment"]),
+        )
+        record.update({key: target.get(key) for key in ("context", "model", "device", "image")})
+        record["applied_at"] = applied_at.isoformat()
+        return record
+
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(targets) or 1))) as executor:
+        records = list(executor.map(measure, targets))
+    with open(results_path, "a") as f:
+        for record in records:
+            if not record["cold_start"]:
+                print(f"{record['deployment']} unchanged by apply, no cold start to record")
+                continue
+            f.write(json.dumps(record) + "\n")
+            print(f"cold start {record}")
+    return records
+
+def measurement_targets(entries: list[dict], template: Template) -> list[dict]:
+    targets = []
+    for entry in entries:
+        manifests = render_manifests(template, str(entry["id"]), entry["model"], entry["device"])
+        for manifest in manifests:
+            if manifest["kind"] == "Deployment":
+                containers = manifest["spec"]["template"]["spec"]["containers"]
+                targets.append({
+                    "deployment": manifest["metadata"]["name"],
+                    "context": entry.get("context"),
+                    "model": entry["model"],
+                    "device": entry["device"],
+                    "image": containers[0]["image"],
+                })
+    return targets
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def summarize_measurements(results_path: str) -> dict:
+    """
+    按 (model, device, image) 汇总历次冷启动测量，打印各阶段 p50/p90/p99。
+    """
+    groups = {}
+    with open(results_path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if not record.get("cold_start", True):
+                    continue
+                groups.setdefault((record["model"], record["device"], record["image"]), []).append(record)
+
+    summary = {}
+    for key, records in sorted(groups.items()):
+        summary[key] = {}
+        print(f"model={key[0]} device={key[1]} image={key[2]} runs={len(records)}")
+        for phase in PHASES + ["total"]:
+            values = sorted(r[phase] for r in records if r.get(phase) is not None)
+            if not values:
+                continue
+            stats = {f"p{int(q * 100)}": _percentile(values, q) for q in (0.5, 0.9, 0.99)}
+            summary[key][phase] = stats
+            print(f"  {phase:<16} " + " ".join(f"{name}={value:.1f}s" for name, value in stats.items()))
+    return summary
+
+# 压测窗口内按 pod 汇总的 vllm 指标；$selector 为 pod 过滤条件，$window 为窗口长度
+SWEEP_QUERIES = {
+    "prompt_tokens": 'sum by (pod)(increase(vllm:prompt_tokens_total{$selector}[$window]))',
+    "generation_tokens": 'sum by (pod)(increase(vllm:generation_tokens_total{$selector}[$window]))',
+    "requests": 'sum by (pod)(increase(vllm:e2e_request_latency_seconds_count{$selector}[$window]))',
+    "e2e_p50": 'histogram_quantile(0.5, sum by (pod, le)(rate(vllm:e2e_request_latency_seconds_bucket{$selector}[$window])))',
+    "e2e_p95": 'histogram_quantile(0.95, sum by (pod, le)(rate(vllm:e2e_request_latency_seconds_bucket{$selector}[$window])))',
+    "ttft_p95": 'histogram_quantile(0.95, sum by (pod, le)(rate(vllm:time_to_first_token_seconds_bucket{$selector}[$window])))',
+}
+
+def expand_sweep_grid(grid: dict) -> list[dict]:
+    """
+    将 {参数: [取值, ...]} 展开为所有参数组合（笛卡尔积），顺序固定。
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def load_sweep_spec(path: str) -> dict:
+    """
+    读取参数扫描配置（YAML/JSON）：id、model、device、grid 必填，
+    可选 context、soak_seconds、gpu_price（每 GPU 小时价格）或 gpu_cost_cluster（GPUHourCost.cluster）。
+    """
+    with open(path) as f:
+        spec = yaml.safe_load(f) or {}
+    missing = [key for key in ("id", "model", "device", "grid") if not spec.get(key)]
+    if missing:
+        raise ValueError(f"sweep spec is missing {', '.join(missing)}")
+    if "gpu_price" not in spec and "gpu_cost_cluster" not in spec:
+        raise ValueError("sweep spec needs gpu_price or gpu_cost_cluster")
+    return spec
+
+def sweep_configs(spec: dict, template: Template) -> list[dict]:
+    """
+    为每个参数组合渲染一组独立的 model-test 资源，identifier 为 <id>-<序号>。
+    """
+    configs = []
+    for index, serving in enumerate(expand_sweep_grid(spec["grid"])):
+        identifier = f"{spec['id']}-{index}"
+        manifests = render_manifests(template, identifier, spec["model"], spec["device"], serving)
+        deployment = next(m for m in manifests if m["kind"] == "Deployment")
+        containers = deployment["spec"]["template"]["spec"]["containers"]
+        gpus = sum(int((c.get("resources") or {}).get("limits", {}).get("nvidia.com/gpu", 0)) for c in containers)
+        configs.append({
+            "deployment": deployment["metadata"]["name"],
+            "serving": serving,
+            "gpus": gpus,
+            "manifests": manifests,
+        })
+    return configs
+
+def query_sweep_metrics(prometheus_url: str, deployment_names: list[str], window_seconds: int, at: float = None) -> dict:
+    """
+    每个指标一次分组查询，返回 {deployment: {指标: 值}}；pod 通过名称去掉 ReplicaSet/pod 后缀映射回 deployment。
+    """
+    selector = 'pod=~"' + "|".join(f"{name}-.*" for name in deployment_names) + '"'
+    url = f"{prometheus_url.rstrip('/')}/api/v1/query"
+    metrics = {name: {} for name in deployment_names}
+    for metric, query in SWEEP_QUERIES.items():
+        params = {"query": Template(query).substitute(selector=selector, window=f"{window_seconds}s")}
+        if at is not None:
+            params["time"] = str(at)
+        for series in stream_query(prom_session, url, params, timeout=30):
+            pod = series.metric.get("pod", "")
+            deployment = pod.rsplit("-", 2)[0]
+            if deployment in metrics and len(series):
+                metrics[deployment][metric] = series.values[-1]
+    return metrics
+
+def _gpu_hour_price(spec: dict) -> float:
+    if "gpu_price" in spec:
+        return float(spec["gpu_price"])
+    import dbutils
+    with dbutils.pg_pool.connection() as conn:
+        gpu = dbutils.GPUHourCostCatalog(conn).get(spec["gpu_cost_cluster"])
+    if gpu is None:
+        raise ValueError(f"No GPUHourCost record for cluster {spec['gpu_cost_cluster']}")
+    return float(gpu.price)
+
+def rank_sweep(configs: list[dict], metrics: dict, gpu_price: float, window_seconds: int) -> list[dict]:
+    """
+    按 cal-mil-cost 的口径（cost_engine.mil_costs）计算每个配置的每百万 token 成本，
+    并按输出 token 成本从低到高排序；没有 token 的配置排在最后。
+    """
+    import cost_engine
+
+    rows = []
+    for config in configs:
+        values = metrics.get(config["deployment"], {})
+        rows.append({
+            "deployment": config["deployment"],
+            "serving": config["serving"],
+            "gpu_cost": gpu_price * config["gpus"] * window_seconds / 3600,
+            "prompt_tokens": values.get("prompt_tokens", 0.0),
+            "generation_tokens": values.get("generation_tokens", 0.0),
+            "requests": values.get("requests", 0.0),
+            "e2e_p50": values.get("e2e_p50"),
+            "e2e_p95": values.get("e2e_p95"),
+            "ttft_p95": values.get("ttft_p95"),
+        })
+    input_mil, output_mil = cost_engine.mil_costs(
+        [row["gpu_cost"] for row in rows],
+        [row["prompt_tokens"] for row in rows],
+        [row["generation_tokens"] for row in rows],
+    )
+    for row, input_cost, output_cost in zip(rows, input_mil.tolist(), output_mil.tolist()):
+        row["generation_tokens_per_second"] = row["generation_tokens"] / window_seconds
+        row["inputCostMil"] = None if math.isnan(input_cost) else input_cost
+        row["outputCostMil"] = None if math.isnan(output_cost) else output_cost
+    rows.sort(key=lambda row: (row["outputCostMil"] is None, row["outputCostMil"] or 0.0))
+    return rows
+
+def teardown_sweep(configs: list[dict], context: str = None) -> None:
+    client = get_client(context)
+    for config in configs:
+        for manifest in config["manifests"]:
+            try:
+                client.delete(manifest["kind"], manifest["metadata"]["name"])
+            except Exception as e:
+                print(f"delete error for {manifest['kind'].lower()}/{manifest['metadata']['name']}: {e}")
 
-    temp_path = "./temp-deployment.yaml"
-    with open(temp_path, 'w') as temp:
-        temp.write(temp_yaml)
+def run_sweep(spec: dict, prometheus_url: str = PROMETHEUS_URL, results_path: str = None, keep: bool = False, timeout: int = 1800) -> list[dict]:
+    """
+    服务参数扫描：部署所有参数组合，等待全部就绪后观察 soak_seconds 秒
+    （压测流量由外部负载发生器提供），再从 Prometheus 取吞吐与延迟、
+    结合 GPU 小时价格按每百万 token 成本排序。默认结束后删除扫描资源。
+    """
+    context = spec.get("context")
+    window_seconds = int(spec.get("soak_seconds", 1800))
+    gpu_price = _gpu_hour_price(spec)
+    configs = sweep_configs(spec, load_template())
+    generations_before = deployment_generations([{"deployment": c["deployment"], "context": context} for c in configs])
+    applied_at = datetime.now(timezone.utc)
+    try:
+        if apply_manifests([m for config in configs for m in config["manifests"]], context) != 0:
+            raise RuntimeError("failed to apply sweep deployments")
+        with ThreadPoolExecutor(max_workers=max(1, min(16, len(configs)))) as executor:
+            readiness = list(executor.map(
+                lambda config: measure_time_to_ready(
+                    config["deployment"], context, applied_at, timeout,
+                    generation_before=generations_before[config["deployment"]],
+                ),
+                configs,
+            ))
+        for record in readiness:
+            if record["timed_out"]:
+                print(f"Warning: {record['deployment']} did not become ready within {timeout}s")
 
-    ret = subprocess.run(f"kubectl apply -f {temp_path}".split(" "))
-    print(f"deployment return code {ret.returncode}")
-    return ret.returncode
+        print(f"All sweep deployments up, observing for {window_seconds}s")
+        time.sleep(window_seconds)
+        metrics = query_sweep_metrics(prometheus_url, [c["deployment"] for c in configs], window_seconds)
+    finally:
+        if not keep:
+            teardown_sweep(configs, context)
+
+    ranked = rank_sweep(configs, metrics, gpu_price, window_seconds)
+    for rank, row in enumerate(ranked, 1):
+        print(
+            f"{rank}. {row['deployment']} {row['serving']} "
+            f"outputCostMil={row['outputCostMil']} inputCostMil={row['inputCostMil']} "
+            f"gen_tok/s={row['generation_tokens_per_second']:.1f} e2e_p95={row['e2e_p95']} ttft_p95={row['ttft_p95']}"
+        )
+    if results_path:
+        with open(results_path, "w") as f:
+            json.dump(ranked, f, indent=2)
+        print(f"Wrote sweep ranking to {results_path}")
+    return ranked
 
 def main():
     args = parser.parse_args()
@@ -98,10 +574,33 @@ def main():
         ok = scale_deployment(args.scale_name, args.replicas)
         raise SystemExit(0 if ok else 1)
 
-    if not args.id or not args.model or not args.device:
+    if args.summarize:
+        summarize_measurements(args.results)
+        raise SystemExit(0)
+
+    if args.sweep:
+        ranked = run_sweep(load_sweep_spec(args.sweep), args.prometheus_url, args.sweep_results, args.keep, args.timeout)
+        raise SystemExit(0 if ranked else 1)
+
+    if args.batch:
+        entries = load_batch_manifest(args.batch)
+    elif not args.id or not args.model or not args.device:
         raise ValueError('absent id or model or device')
+    else:
+        entries = [{"id": args.id, "model": args.model, "device": args.device, "context": args.context}]
+
+    targets = measurement_targets(entries, load_template()) if args.measure else []
+    generations_before = deployment_generations(targets) if args.measure else {}
+    applied_at = datetime.now(timezone.utc)
+    if args.batch:
+        results = deploy_batch(entries, args.workers)
+        ok = all(rc == 0 for rc in results.values())
+    else:
+        ok = deploy_model(args.model, args.id, args.device, args.context) == 0
 
-    deploy_model(args.model, args.id, args.device)
+    if args.measure and ok:
+        measure_deployments(targets, applied_at, args.results, args.timeout, generations_before)
+    raise SystemExit(0 if ok else 1)
 
 
 if __name__ == "__main__":
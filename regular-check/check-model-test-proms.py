@@ -1,8 +1,22 @@
+import argparse
 import requests
 from collections import defaultdict
-import subprocess
-import json
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from job_metrics import add_metrics_arguments, configure
+from kube_client import KubeApiError, get_client
+from prom_stream import PromQueryError, format_value, stream_query
+
+metrics = configure("check-model-test-proms")
 
 cluster_metas=[
     {"context": "flow-do-nyc2", "vendor": "digitalocean"},
@@ -11,32 +25,181 @@ cluster_metas=[
 
 exclude_lists=["model-test-qwen3-embedding"]
 
-def get_deployments_starting_with(prefix, context):
-    try:
-        # Command: Get all Deployments in the default namespace, output as JSON
-        cmd = ['kubectl', 'get', 'deployments', '-o', 'json', '--context', context]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        
-        deployment_names = []
+@dataclass
+class DeploymentInfo:
+    """The fields of a deployment that the check decides on"""
+    name: str
+    creation_timestamp: str
+    ready_replicas: int
+    labels: dict
+    replicas: int = 1
+    resource_version: str = ''
+
+class DeploymentSnapshot:
+    """All deployments of one context, listed once per run and indexed by name"""
+
+    def __init__(self, context, deployments):
+        self.context = context
+        self.deployments = {d.name: d for d in deployments}
+
+    @staticmethod
+    def info_from_item(item):
+        metadata = item.get('metadata', {})
+        return DeploymentInfo(
+            name=metadata.get('name', ''),
+            creation_timestamp=metadata.get('creationTimestamp', ''),
+            ready_replicas=item.get('status', {}).get('readyReplicas', 0),
+            labels=metadata.get('labels', {}) or {},
+            replicas=item.get('spec', {}).get('replicas', 1),
+            resource_version=metadata.get('resourceVersion', ''),
+        )
+
+    @classmethod
+    def from_items(cls, context, items):
+        return cls(context, [cls.info_from_item(item) for item in items])
+
+    @classmethod
+    def take(cls, context):
+        """
+        List every deployment in the context with a single API call
+
+        Listing errors (KubeApiError, connection errors) are raised, so an
+        unreachable or unauthorized API server fails the context's reconciliation
+        instead of looking like a context without deployments.
+        """
+        # Get all Deployments in the default namespace
+        data = get_client(context).list("deployment")
+        return cls.from_items(context, data.get('items', []))
+
+    def names_starting_with(self, prefix):
+        return [name for name in self.deployments if name.startswith(prefix)]
+
+    def get(self, name):
+        return self.deployments.get(name)
+
+
+class ResourceWatcher(threading.Thread):
+    """
+    Keeps a context's objects of one kind current from a watch stream
+
+    Lists once, then applies ADDED/MODIFIED/DELETED events; relists when the
+    watch expires (410 Gone) or the connection fails. Objects are kept by
+    name as whatever entry() makes of them; entry() returning None drops one.
+    """
+
+    kind = None
+
+    def __init__(self, context, retry_seconds=5):
+        super().__init__(name=f"watch-{self.kind}-{context}", daemon=True)
+        self.context = context
+        self.retry_seconds = retry_seconds
+        self._items = {}
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def entry(self, item):
+        raise NotImplementedError
+
+    def items(self):
+        with self._lock:
+            return dict(self._items)
+
+    def _relist(self, client):
+        data = client.list(self.kind)
+        items = {}
         for item in data.get('items', []):
-            name = item.get('metadata', {}).get('name', '')
-            if name.startswith(prefix):
-                deployment_names.append(name)
-                
-        return deployment_names
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing kubectl command: {e}")
-        return []
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON output from kubectl: {e}")
-        return []
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return []
+            value = self.entry(item)
+            if value is not None:
+                items[item.get('metadata', {}).get('name', '')] = value
+        with self._lock:
+            self._items = items
+        self.ready.set()
+        return data.get('metadata', {}).get('resourceVersion')
+
+    def run(self):
+        resource_version = None
+        while True:
+            try:
+                client = get_client(self.context)
+                if resource_version is None:
+                    resource_version = self._relist(client)
+                for event in client.watch(self.kind, resource_version=resource_version):
+                    obj = event.get('object', {})
+                    if event.get('type') == 'ERROR':
+                        # Usually 410 Gone: our resourceVersion is too old
+                        print(f"[{self.context}] {self.kind} watch expired: {obj.get('message')}")
+                        resource_version = None
+                        break
+                    resource_version = obj.get('metadata', {}).get('resourceVersion', resource_version)
+                    if event.get('type') == 'BOOKMARK':
+                        continue
+                    name = obj.get('metadata', {}).get('name', '')
+                    value = None if event.get('type') == 'DELETED' else self.entry(obj)
+                    with self._lock:
+                        if value is None:
+                            self._items.pop(name, None)
+                        else:
+                            self._items[name] = value
+            except Exception as e:
+                print(f"[{self.context}] {self.kind} watch failed, relisting in {self.retry_seconds}s: {e}")
+                metrics.inc("retries", operation="watch_relist", context=self.context, kind=self.kind)
+                resource_version = None
+                time.sleep(self.retry_seconds)
+
+
+class DeploymentWatcher(ResourceWatcher):
+    """Watch-maintained DeploymentInfo of every deployment in a context"""
+
+    kind = "deployment"
+
+    def entry(self, item):
+        return DeploymentSnapshot.info_from_item(item)
+
+    def snapshot(self):
+        return DeploymentSnapshot(self.context, list(self.items().values()))
+
+
+class PodOwnerWatcher(ResourceWatcher):
+    """Watch-maintained pod name -> PodInfo index of a context, see pod_info()"""
+
+    kind = "pod"
+
+    def entry(self, item):
+        return pod_info(item)
+
+
+class ContextCache:
+    """
+    Daemon-mode state of one context: its deployment and pod watches, and
+    the resourceVersion each deployment had when it was last scaled or deleted
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.deployments = DeploymentWatcher(context)
+        self.pods = PodOwnerWatcher(context)
+        self.acted = {}
+
+    def start(self):
+        self.deployments.start()
+        self.pods.start()
+
+    def wait_ready(self, timeout):
+        """Wait up to timeout seconds for both watches to finish their first listing"""
+        deadline = time.monotonic() + timeout
+        return self.deployments.ready.wait(timeout) and self.pods.ready.wait(max(0, deadline - time.monotonic()))
+
+    def is_ready(self):
+        return self.deployments.ready.is_set() and self.pods.ready.is_set()
+
+
+def get_deployments_starting_with(prefix, context, snapshot=None):
+    if snapshot is None:
+        snapshot = DeploymentSnapshot.take(context)
+    return snapshot.names_starting_with(prefix)
 
 
-def filter_deployments_by_age_and_replicas(deployment_names, context, days_threshold=60):
+def filter_deployments_by_age_and_replicas(deployment_names, context, days_threshold=60, snapshot=None):
     """
     Filter deployments by creation time and replica count
     
@@ -44,35 +207,32 @@ def filter_deployments_by_age_and_replicas(deployment_names, context, days_thres
         deployment_names: List of deployment names
         context: kubectl context
         days_threshold: Days threshold, default is 60 days
+        snapshot: DeploymentSnapshot of the context; taken here if not given
         
     Returns:
         List of deployment names that meet the criteria (older than threshold and no replicas)
     """
     from datetime import datetime, timezone
-    import subprocess
-    import json
     
+    if snapshot is None:
+        snapshot = DeploymentSnapshot.take(context)
+
     filtered_deployments = []
     
     for dep_name in deployment_names:
         try:
-            # Get detailed information for specific deployment
-            cmd = ['kubectl', 'get', 'deployment', dep_name, '-o', 'json', '--context', context]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                print(f"Error getting deployment {dep_name}: {result.stderr}")
+            deployment = snapshot.get(dep_name)
+            if deployment is None:
+                print(f"Error getting deployment {dep_name}: not found in context {context}")
                 continue
-                
-            deployment_data = json.loads(result.stdout)
             
             # Get creation timestamp
-            creation_str = deployment_data.get('metadata', {}).get('creationTimestamp', '')
+            creation_str = deployment.creation_timestamp
             if not creation_str:
                 raise ValueError(f"Could not get creation timestamp for deployment {dep_name}")
                 
             # Get ready replicas count
-            ready_replicas = deployment_data.get('status', {}).get('readyReplicas', 0)
+            ready_replicas = deployment.ready_replicas
             if ready_replicas is None:
                 raise ValueError(f"Could not get ready replicas count for deployment {dep_name}")
             
@@ -98,8 +258,6 @@ def filter_deployments_by_age_and_replicas(deployment_names, context, days_thres
             if days_old > days_threshold and ready_replicas == 0:
                 filtered_deployments.append(dep_name)
                 
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON output for deployment {dep_name}: {e}")
         except ValueError as e:
             print(f"Value error for deployment {dep_name}: {e}")
         except Exception as e:
@@ -108,7 +266,21 @@ def filter_deployments_by_age_and_replicas(deployment_names, context, days_thres
     return filtered_deployments
 
 
-requests_query_tmpl='increase(vllm:e2e_request_latency_seconds_count{pod=~"model-test.*",vendor="$vendor"}[1h])'
+# A deployment only counts as idle once its pods have been Ready for the whole query window
+IDLE_WINDOW = timedelta(hours=1)
+requests_query_tmpl='increase(vllm:e2e_request_latency_seconds_count{pod=~"model-test.*",vendor="$vendor"}[$window])'
+
+session = requests.Session()
+
+def iter_prometheus_series(prometheus_url, query, timeout=10):
+    """
+    Run an instant query and yield its result series one at a time
+
+    The response is decoded incrementally, so memory follows the largest
+    series rather than the whole payload. Errors are raised, not printed.
+    """
+    url = f"{prometheus_url}/api/v1/query"
+    yield from stream_query(session, url, {"query": query}, timeout)
 
 def query_prometheus(prometheus_url, query, timeout=10):
     """
@@ -123,30 +295,13 @@ def query_prometheus(prometheus_url, query, timeout=10):
         Parsed query results, or None if an error occurs
     """
     try:
-        # Construct the query URL
-        url = f"{prometheus_url}/api/v1/query"
-        
-        # Set query parameters
-        params = {
-            "query": query
-        }
-        
-        # Send GET request
-        response = requests.get(url, params=params, timeout=timeout)
-        response.raise_for_status()  # Will raise HTTPError for bad status codes
-        
-        # Parse JSON response
-        result = response.json()
-        
-        # Check response status
-        if result.get("status") == "success":
-            return result.get("data", {}).get("result", [])
-        else:
-            print(f"Query failed: {result.get('error', 'Unknown error')}")
-            return None
-            
-    except requests.exceptions.HTTPError as e:
-        print(f"HTTP error occurred: {e}")
+        return [
+            {"metric": s.metric, "value": [s.timestamps[0], format_value(s.values[0])]}
+            for s in iter_prometheus_series(prometheus_url, query, timeout)
+            if len(s)
+        ]
+    except PromQueryError as e:
+        print(f"Query failed: {e}")
     except requests.exceptions.ConnectionError:
         print("Connection error, please check if Prometheus address is correct")
     except requests.exceptions.Timeout:
@@ -155,28 +310,90 @@ def query_prometheus(prometheus_url, query, timeout=10):
         print(f"An error occurred: {e}")
     return None
 
-def before_second_last_hyphen(pod_name: str) -> str:
-    # Find all '-' positions
-    hyphen_indices = [i for i, ch in enumerate(pod_name) if ch == '-']
+# Pod names are <deployment>-<pod-template-hash>-<5 char suffix>
+POD_NAME_PATTERN = re.compile(r"^(?P<deployment>.+)-(?P<hash>[0-9a-z]{1,10})-(?P<suffix>[bcdfghjklmnpqrstvwxz2456789]{5})$")
+
+def deployment_from_pod_name(pod_name: str):
+    """Parse the owning deployment out of a pod name, or None if it is not a deployment pod"""
+    match = POD_NAME_PATTERN.match(pod_name)
+    if match is None:
+        return None
+    return match.group("deployment")
+
+def pod_owner(pod):
+    """
+    The deployment owning a pod, from its ReplicaSet owner reference, or None
+
+    A ReplicaSet created by a deployment is named <deployment>-<pod-template-hash>,
+    so stripping the pod's pod-template-hash label gives the deployment exactly.
+    """
+    metadata = pod.get('metadata', {})
+    template_hash = (metadata.get('labels') or {}).get('pod-template-hash')
+    if not template_hash:
+        return None
+    for owner in metadata.get('ownerReferences') or []:
+        replicaset = owner.get('name', '')
+        if owner.get('kind') == 'ReplicaSet' and replicaset.endswith(f"-{template_hash}"):
+            return replicaset[:-len(template_hash) - 1]
+    return None
+
+@dataclass
+class PodInfo:
+    """The owning deployment of a pod and when it last became Ready (None while not Ready)"""
+    deployment: str
+    ready_since: Optional[datetime]
 
-    if len(hyphen_indices) < 2:
-        raise ValueError("Input string must contain at least two hyphens ('-')")
+def pod_info(pod):
+    """PodInfo of a deployment pod, or None for pods no deployment owns"""
+    deployment = pod_owner(pod)
+    if deployment is None:
+        return None
+    ready_since = None
+    for condition in pod.get('status', {}).get('conditions') or []:
+        if condition.get('type') == 'Ready' and condition.get('status') == 'True' and condition.get('lastTransitionTime'):
+            ready_since = datetime.fromisoformat(condition['lastTransitionTime'].replace("Z", "+00:00"))
+    return PodInfo(deployment, ready_since)
 
-    second_last_idx = hyphen_indices[-1]
+def build_pod_owner_index(context):
+    """Map live pod names to their PodInfo with one pod listing (daemon mode watches pods instead)"""
+    index = {}
+    for pod in get_client(context).list("pod").get('items', []):
+        info = pod_info(pod)
+        if info is not None:
+            index[pod.get('metadata', {}).get('name')] = info
+    return index
 
-    # Return the substring before that position (excluding '-')
-    return pod_name[:second_last_idx]
+def ready_since_by_deployment(pod_index):
+    """
+    When every pod of each deployment was Ready, i.e. the latest Ready
+    transition among its pods; None if any of its pods is not Ready
+    """
+    ready_since = {}
+    for info in pod_index.values():
+        if info.ready_since is None or (info.deployment in ready_since and ready_since[info.deployment] is None):
+            ready_since[info.deployment] = None
+        else:
+            ready_since[info.deployment] = max(ready_since.get(info.deployment) or info.ready_since, info.ready_since)
+    return ready_since
+
+def requests_by_deployment(series, pod_index):
+    """Sum per-pod request counts (PromSeries) into per-deployment totals in a single pass"""
+    stats=defaultdict(float)
+    for item in series:
+        pod_name = item.metric['pod']
+        info = pod_index.get(pod_name)
+        deployment = info.deployment if info is not None else deployment_from_pod_name(pod_name)
+        if deployment is None:
+            print(f"Skipping pod {pod_name}: cannot determine its deployment")
+            continue
+        stats[deployment] += sum(item.values)
+    return stats
 
 def scale_deployment(deployment_name: str, replicas: int, context: str) -> bool:
-    cmd = ["kubectl", "scale", "deployment", deployment_name, f"--replicas={replicas}", "--context", context]
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-    except FileNotFoundError:
-        print("kubectl not found in PATH")
-        return False
-    if proc.returncode != 0:
-        stderr = proc.stderr.strip()
-        print(f"kubectl scale error (rc={proc.returncode}): {stderr}")
+        get_client(context).scale("deployment", deployment_name, replicas)
+    except Exception as e:
+        print(f"Scale error for deployment '{deployment_name}': {e}")
         return False
     print(f"Scaled deployment '{deployment_name}' to {replicas} replicas.")
     return True
@@ -215,6 +432,42 @@ def filter_old_deployments_without_replicas(deployments):
             
     return filtered_deployments
 
+TEARDOWN_RESOURCE_TYPES = ['deployment', 'service', 'ingress']
+
+def _delete_resource(resource_type, resource_name, context):
+    try:
+        # Missing resources count as deleted, like kubectl --ignore-not-found
+        get_client(context).delete(resource_type, resource_name, ignore_not_found=True)
+        print(f"Successfully deleted {resource_type} '{resource_name}' in context '{context}'")
+        return True
+    except KubeApiError as e:
+        print(f"Error deleting {resource_type} '{resource_name}': {e}")
+    except Exception as e:
+        print(f"Exception occurred while deleting {resource_type} '{resource_name}': {str(e)}")
+    return False
+
+def delete_resources_by_names(resource_names, context, max_workers=8):
+    """
+    Delete the Deployment, Service, and Ingress of every given name in parallel.
+    
+    Args:
+        resource_names (list): Names of the resources to delete
+        context (str): Kubernetes context to operate in
+        max_workers (int): Maximum number of delete requests in flight
+        
+    Returns:
+        dict: For each name, the status of deletion for each resource type
+    """
+    tasks = [(name, resource_type) for name in resource_names for resource_type in TEARDOWN_RESOURCE_TYPES]
+    deletion_status = {name: {resource_type: False for resource_type in TEARDOWN_RESOURCE_TYPES} for name in resource_names}
+    if not tasks:
+        return deletion_status
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as executor:
+        outcomes = executor.map(lambda task: _delete_resource(task[1], task[0], context), tasks)
+        for (name, resource_type), deleted in zip(tasks, outcomes):
+            deletion_status[name][resource_type] = deleted
+    return deletion_status
+
 def delete_resources_by_name(resource_name, context):
     """
     Delete Deployment, Service, and Ingress resources with the given name in the specified context.
@@ -226,95 +479,222 @@ def delete_resources_by_name(resource_name, context):
     Returns:
         dict: Status of deletion for each resource type
     """
-    import subprocess
-    
-    deletion_status = {
-        'deployment': False,
-        'service': False,
-        'ingress': False
-    }
-    
-    # Define resource types to delete
-    resource_types = ['deployment', 'service', 'ingress']
-    
-    for resource_type in resource_types:
-        try:
-            # Execute kubectl delete command for each resource type
-            cmd = ['kubectl', 'delete', resource_type, resource_name, '--context', context, '--ignore-not-found=true']
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print(f"Successfully deleted {resource_type} '{resource_name}' in context '{context}'")
-                deletion_status[resource_type] = True
-            else:
-                print(f"Error deleting {resource_type} '{resource_name}': {result.stderr}")
-        except Exception as e:
-            print(f"Exception occurred while deleting {resource_type} '{resource_name}': {str(e)}")
-    
-    return deletion_status
+    return delete_resources_by_names([resource_name], context)[resource_name]
 
-if __name__ == "__main__":
-    
-    print(f"Starting script at: {datetime.now()}")
-    # Prometheus server address, modify according to your actual environment
-    PROMETHEUS_URL = "http://172.31.255.83:9090/"
-    # PromQL query to execute
-    #QUERY = "sum by(job)(increase(vllm:request_generation_tokens_count[24h]))"
-    
-    for meta in cluster_metas:
-        context=meta["context"]
-        vendor=meta["vendor"]
-        print(f"Switching to context: {context}")
+def scale_deployments(deployment_names, replicas, context, max_workers=8):
+    """
+    Scale many deployments in parallel
+
+    Returns:
+        dict: For each deployment name, whether scaling succeeded
+    """
+    if not deployment_names:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(deployment_names)))) as executor:
+        outcomes = executor.map(lambda name: scale_deployment(name, replicas, context), deployment_names)
+        return dict(zip(deployment_names, outcomes))
+
+def reconcile_context(meta, prometheus_url, snapshot=None, pod_index=None, acted=None):
+    """
+    Scale idle model-test deployments to zero and delete stale ones in one context
 
-        query= requests_query_tmpl.replace("$vendor", vendor)
+    A watch-maintained snapshot and pod index can be passed in; otherwise
+    they are listed. acted maps deployment names to the resourceVersion they
+    had when last scaled or deleted; deployments unchanged since are skipped,
+    and the map is updated with this run's actions. Deployments only count
+    as idle once all their pods have been Ready for IDLE_WINDOW.
+
+    Returns:
+        Report dict with the context, the deployments scaled, the per-resource
+        deletion status of stale deployments, and the error that stopped the
+        reconciliation (None on success)
+    """
+    context=meta["context"]
+    vendor=meta["vendor"]
+    report = {"context": context, "scaled": [], "deleted": {}, "error": None}
+    print(f"[{context}] Switching to context: {context}")
+
+    try:
+        query= requests_query_tmpl.replace("$vendor", vendor).replace("$window", f"{int(IDLE_WINDOW.total_seconds())}s")
         # Execute the query
-        print(f"Querying Prometheus: {query}")
-        results = query_prometheus(PROMETHEUS_URL, query)
-        print()
-        print(results)
-        print()
-        stats=defaultdict(float)
-        for item in results:
-            pod_name = item['metric']['pod']
-            #print(f"Original pod name: {pod_name}")
-            modified_name = before_second_last_hyphen(pod_name)
-            #print(f"Modified pod name: {modified_name}")
-            item_value = float(item['value'][1])
-            stats[modified_name] += item_value
-        print(stats)
-        print()
-
-        deployments = get_deployments_starting_with("model-test", context)
-        print(f"Deployments in context {context} starting with 'model-test':\n {deployments}")
+        print(f"[{context}] Querying Prometheus: {query}")
+        # Series are decoded and summed one at a time as the response streams in
+        results = iter_prometheus_series(prometheus_url, query)
+        if pod_index is None:
+            try:
+                with metrics.span("list_pods", context=context):
+                    pod_index = build_pod_owner_index(context)
+            except Exception as e:
+                # Pod names still resolve through their hash suffix, but without
+                # readiness times no deployment can be considered idle
+                print(f"[{context}] Failed to list pods, falling back to pod name parsing and skipping idle scaling: {e}")
+                pod_index = {}
+        with metrics.span("prometheus", context=context):
+            stats = requests_by_deployment(results, pod_index)
+        print(f"[{context}] {dict(stats)}")
+
+        # One listing per context feeds every decision below
+        if snapshot is None:
+            with metrics.span("list_deployments", context=context):
+                snapshot = DeploymentSnapshot.take(context)
+        deployments = get_deployments_starting_with("model-test", context, snapshot)
+        print(f"[{context}] Deployments starting with 'model-test':\n {deployments}")
+
+        if acted is None:
+            acted = {}
+        for name in list(acted):
+            if snapshot.get(name) is None:
+                del acted[name]
+
+        def unchanged_since_acted(name):
+            version = snapshot.get(name).resource_version
+            return bool(version) and acted.get(name) == version
+
+        def record_action(name):
+            if snapshot.get(name).resource_version:
+                acted[name] = snapshot.get(name).resource_version
         
         # Filter deployments using the new function
-        old_deployments_without_replicas = filter_deployments_by_age_and_replicas(deployments, context)
-        print(f"Deployments older than 60 days with no replicas in {context}: {old_deployments_without_replicas}")
+        old_deployments_without_replicas = filter_deployments_by_age_and_replicas(deployments, context, snapshot=snapshot)
+        print(f"[{context}] Deployments older than 60 days with no replicas: {old_deployments_without_replicas}")
         
         for one in exclude_lists:
             if one in deployments:
-                print(f"Excluding deployment {one}")
+                print(f"[{context}] Excluding deployment {one}")
                 deployments.remove(one)
 
+        ready_since = ready_since_by_deployment(pod_index)
+        idle_before = datetime.now(timezone.utc) - IDLE_WINDOW
+        idle_deployments = []
         for d in deployments:
-            reclaim=True
-            match_pod=False
-            for p in stats:
-                if d in p:
-                    match_pod=True
-                    if stats[p]!=0:
-                        reclaim=False
-            if match_pod and reclaim:
-                print(f"Warning: Deployment {d} don't have any requests in the last hour")
-                succeed=scale_deployment(d, 0, context)
-                if not succeed:
-                    raise ValueError(f"Failed to scale down deployment {d} in the cluster {context}")
-
-        print("--------------------------------------------------")
+            # Only deployments with pods reporting metrics and zero requests are idle
+            # Deployments already scaled to zero need no action
+            if d in stats and stats[d] == 0 and snapshot.get(d).replicas != 0:
+                # A zero over a window the pods were not Ready for says nothing
+                if ready_since.get(d) is None or ready_since[d] > idle_before:
+                    print(f"[{context}] Deployment {d} has no requests but its pods have not been Ready for {int(IDLE_WINDOW.total_seconds())}s, skipping")
+                    continue
+                if unchanged_since_acted(d):
+                    print(f"[{context}] Deployment {d} already scaled down and unchanged since, skipping")
+                    continue
+                print(f"[{context}] Warning: Deployment {d} don't have any requests in the last hour")
+                idle_deployments.append(d)
+
+        with metrics.span("scale", context=context):
+            scale_status = scale_deployments(idle_deployments, 0, context)
+        report["scaled"] = [d for d, succeed in scale_status.items() if succeed]
+        for d in report["scaled"]:
+            record_action(d)
+        metrics.inc("records", len(report["scaled"]), context=context, action="scaled")
+        failed = [d for d, succeed in scale_status.items() if not succeed]
+        if failed:
+            raise ValueError(f"Failed to scale down deployments {failed} in the cluster {context}")
 
+        stale_deployments = []
         for d in old_deployments_without_replicas:
             if d in exclude_lists:
-                print(f"Excluding deployment {d} from deletion")
+                print(f"[{context}] Excluding deployment {d} from deletion")
+                continue
+            if unchanged_since_acted(d):
+                print(f"[{context}] Deployment {d} already deleted and unchanged since, skipping")
                 continue
-            print(f"Deleting old resources for deployment: {d}")
-            delete_resources_by_name(d, context)
+            stale_deployments.append(d)
+        print(f"[{context}] Deleting old resources for deployments: {stale_deployments}")
+        with metrics.span("delete", context=context):
+            report["deleted"] = delete_resources_by_names(stale_deployments, context)
+        for d, status in report["deleted"].items():
+            if all(status.values()):
+                record_action(d)
+        metrics.inc("records", len(report["deleted"]), context=context, action="deleted")
+    except Exception as e:
+        print(f"[{context}] Reconciliation failed: {e}")
+        metrics.inc("stage_errors", stage="reconcile", context=context)
+        report["error"] = str(e)
+
+    return report
+
+def print_report(reports):
+    print("--------------------------------------------------")
+    print("Reconciliation report:")
+    for report in reports:
+        status = "FAILED" if report["error"] else "ok"
+        print(f"  {report['context']}: {status}, scaled={report['scaled']}, deleted={report['deleted']}")
+        if report["error"]:
+            print(f"    error: {report['error']}")
+
+def reconcile_all(prometheus_url, executor, caches=None):
+    """
+    Reconcile every context concurrently, timing each one
+
+    With caches (daemon mode), contexts whose watches have not finished their
+    first listing are skipped and reported as failed.
+    """
+    def reconcile(meta):
+        context = meta["context"]
+        if caches is None:
+            with metrics.span("reconcile", context=context):
+                return reconcile_context(meta, prometheus_url)
+        cache = caches[context]
+        if not cache.is_ready():
+            print(f"[{context}] Watch caches are not ready yet, skipping")
+            metrics.inc("stage_errors", stage="reconcile", context=context)
+            return {"context": context, "scaled": [], "deleted": {}, "error": "watch caches not ready"}
+        with metrics.span("reconcile", context=context):
+            return reconcile_context(
+                meta, prometheus_url, cache.deployments.snapshot(), cache.pods.items(), cache.acted
+            )
+    return list(executor.map(reconcile, cluster_metas))
+
+def run_daemon(prometheus_url, workers, interval, metrics_textfile=None, pushgateway=None, ready_timeout=60):
+    """
+    Evaluate the idle rule every interval seconds against watch-maintained deployment and pod caches
+
+    Startup waits at most ready_timeout seconds for the first listings;
+    contexts still listing are reported as failed until they catch up.
+    """
+    caches = {meta["context"]: ContextCache(meta["context"]) for meta in cluster_metas}
+    for cache in caches.values():
+        cache.start()
+    deadline = time.monotonic() + ready_timeout
+    for cache in caches.values():
+        if not cache.wait_ready(max(0, deadline - time.monotonic())):
+            print(f"[{cache.context}] Watch caches not ready after {ready_timeout}s, skipping the context until they are")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while True:
+            started = time.monotonic()
+            metrics.restart()
+            print(f"Reconciling at: {datetime.now()}")
+            reports = reconcile_all(prometheus_url, executor, caches)
+            print_report(reports)
+            metrics.finish(not any(report["error"] for report in reports))
+            metrics.export(metrics_textfile, pushgateway)
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4, help="number of contexts reconciled concurrently")
+    parser.add_argument("--daemon", action="store_true", help="keep running and reconcile every --interval seconds")
+    parser.add_argument("--interval", type=int, default=60, help="seconds between reconciliations in daemon mode")
+    parser.add_argument("--ready-timeout", type=int, default=60, help="seconds the daemon waits for its watch caches at startup")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    
+    print(f"Starting script at: {datetime.now()}")
+    # Prometheus server address, modify according to your actual environment
+    PROMETHEUS_URL = "http://172.31.255.83:9090/"
+    # PromQL query to execute
+    #QUERY = "sum by(job)(increase(vllm:request_generation_tokens_count[24h]))"
+
+    if args.daemon:
+        run_daemon(PROMETHEUS_URL, args.workers, args.interval, args.metrics_textfile, args.pushgateway, args.ready_timeout)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        reports = reconcile_all(PROMETHEUS_URL, executor)
+
+    print_report(reports)
+    failed = any(report["error"] for report in reports)
+    metrics.finish(not failed)
+    metrics.export(args.metrics_textfile, args.pushgateway)
+    if failed:
+        raise SystemExit(1)